@@ -0,0 +1,98 @@
+import time
+import asyncio
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from PIL import UnidentifiedImageError
+from app.models.fashion_clip import FashionClipSingleton
+from app.models.schp import SCHPSingleton
+from app.models.object_detection import FashionObjectDetector
+from app.models.registry import model_registry
+from app.schemas.analyze import AnalyzeResponse
+from app.utils.cache import result_cache
+from app.utils.credits import check_and_decrement_credit, get_user_id_from_token
+from app.utils.executor import get_executor
+from app.utils.image import load_image
+from app.utils.metrics import timed
+
+TASKS = ("search", "classify", "segment", "detect")
+DEFAULT_TASKS = ",".join(TASKS)
+TASK_MODELS = {"search": "clip", "classify": "clip", "segment": "schp", "detect": "detector"}
+
+router = APIRouter()
+
+async def _require_task_models(tasks: str = Form(DEFAULT_TASKS),
+                                _user_id: str = Depends(get_user_id_from_token)):
+    # Models of the requested tasks, checked before the credit is taken (unknown tasks: 400 in the handler)
+    names = {TASK_MODELS[t] for t in (t.strip().lower() for t in tasks.split(",")) if t in TASK_MODELS}
+    await model_registry.ensure_loaded(*sorted(names))
+
+@router.post("/", response_model=AnalyzeResponse)
+async def analyze_image(
+    image: UploadFile = File(...),
+    tasks: str = Form(DEFAULT_TASKS),
+    labels: str = Form(None),
+    top_k: int = Form(6),
+    label: str = Form(None),
+    parsers: str = Form("atr,lip"),
+    threshold: float = Form(0.3),
+    _models: None = Depends(_require_task_models),
+    user_id: str = Depends(check_and_decrement_credit)
+):
+    # One upload, one credit and one decode for every selected task; the models run concurrently
+    task_list = list(dict.fromkeys(t.strip().lower() for t in tasks.split(",") if t.strip()))
+    unknown = [t for t in task_list if t not in TASKS]
+    if not task_list or unknown:
+        raise HTTPException(status_code=400, detail=f"Tâches invalides : {', '.join(unknown) or 'aucune'} (attendues : {', '.join(TASKS)})")
+    label_list = [l.strip() for l in labels.split(",") if l.strip()] if labels else []
+    if "classify" in task_list and not label_list:
+        raise HTTPException(status_code=400, detail="labels requis pour la tâche classify")
+    search_labels = [l.strip() for l in label.split(",") if l.strip()] if label else None
+    parser_list = [p.strip().lower() for p in parsers.split(",") if p.strip()]
+
+    begin = time.perf_counter()
+    contents = await image.read()
+    use_clip = "search" in task_list or "classify" in task_list
+    clip = FashionClipSingleton.get_instance() if use_clip else None
+    cache_key = result_cache.make_key("analyze", contents, tasks=sorted(task_list), labels=label_list, top_k=top_k,
+                                      label=search_labels, parsers=sorted(set(parser_list)), threshold=threshold,
+                                      catalogue=clip.catalogue.cache_tag() if "search" in task_list else None)
+    response = result_cache.get(cache_key)
+    if response is not None:
+        return {**response, "timings_ms": {"total": (time.perf_counter() - begin) * 1000}, "cached": True}
+
+    detector = FashionObjectDetector.get_instance() if "detect" in task_list else None
+    # SCHP works best on the full pixel budget; CLIP and the detector only need their processor size
+    min_side = None
+    if "segment" not in task_list:
+        min_side = max(model.image_min_side for model in (clip, detector) if model is not None)
+    start = time.perf_counter()
+    try:
+        decoded = await run_in_threadpool(load_image, contents, min_side=min_side)
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Le fichier uploadé n'est pas une image valide ou est corrompu.")
+    timings = {"decode": (time.perf_counter() - start) * 1000}
+
+    jobs = {}
+    if use_clip:
+        jobs["clip"] = get_executor("clip").run(
+            timed, clip.analyze, decoded, top_k=top_k, classify_labels=label_list if "classify" in task_list else None,
+            search="search" in task_list, labels=search_labels)
+    if "segment" in task_list:
+        jobs["segment"] = get_executor("schp").run(timed, SCHPSingleton.get_instance().segment, decoded, parser_list)
+    if "detect" in task_list:
+        jobs["detect"] = get_executor("detector").run(timed, detector.detect, decoded, threshold=threshold)
+    done = dict(zip(jobs, await asyncio.gather(*jobs.values())))
+
+    response = {}
+    if "clip" in done:
+        (clip_results, clip_timings), elapsed = done["clip"]
+        response.update(clip_results)
+        timings.update(clip_timings)
+        timings["clip"] = elapsed
+    if "segment" in done:
+        response["segmentation"], timings["segment"] = done["segment"]
+    if "detect" in done:
+        response["detected_objects"], timings["detect"] = done["detect"]
+    result_cache.put(cache_key, response)
+    timings["total"] = (time.perf_counter() - begin) * 1000
+    return {**response, "timings_ms": timings, "cached": False}
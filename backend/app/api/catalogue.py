@@ -0,0 +1,94 @@
+import os
+import hmac
+import time
+import hashlib
+from typing import List
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException, Query, Depends
+from fastapi.concurrency import run_in_threadpool
+from PIL import UnidentifiedImageError
+from app.models.fashion_clip import FashionClipSingleton
+from app.models.registry import model_registry
+from app.utils.executor import get_executor
+from app.utils.process import prefork_worker
+
+CATALOGUE_ADMIN_TOKEN = os.environ.get("CATALOGUE_ADMIN_TOKEN")
+UPLOAD_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data", "uploads"))
+
+router = APIRouter()
+
+def require_admin_token(x_admin_token: str = Header(None)):
+    # Catalogue writes are disabled unless CATALOGUE_ADMIN_TOKEN is configured
+    if not CATALOGUE_ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, CATALOGUE_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Accès refusé")
+    # Each pre-fork worker has its own copy of the catalogue: a write would only reach one of them
+    if prefork_worker() is not None:
+        raise HTTPException(status_code=403, detail="Catalogue en lecture seule en mode pre-fork (app.serve)")
+
+def _store_upload(contents: bytes, filename: str) -> str:
+    # Stored under app/data so the image is served by /static like the rest of the catalogue
+    ext = os.path.splitext(filename or "")[1].lower() or ".jpg"
+    name = hashlib.sha256(contents).hexdigest()[:20] + ext
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, name)
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(contents)
+    return f"uploads/{name}"
+
+def _ingest(uploads, labels):
+    clip = FashionClipSingleton.get_instance()
+    # Every image is decoded before any file is written: a 400 leaves no orphan upload behind
+    images = []
+    for contents, filename in uploads:
+        try:
+            images.append(clip.decode_image(contents))
+        except UnidentifiedImageError:
+            raise HTTPException(status_code=400, detail=f"{filename} n'est pas une image valide")
+    items = [{"label": label, "path": _store_upload(contents, filename)}
+             for (contents, filename), label in zip(uploads, labels)]
+    return clip.ingest(images, items)
+
+@router.get("/")
+async def catalogue_stats(_models: None = Depends(model_registry.requires("clip", authenticated=False))):
+    return FashionClipSingleton.get_instance().catalogue.stats()
+
+@router.post("/items")
+async def add_items(
+    images: List[UploadFile] = File(...),
+    labels: str = Form(...),
+    _: None = Depends(require_admin_token),
+    _models: None = Depends(model_registry.requires("clip", authenticated=False))
+):
+    # labels: one label for every image, or one comma-separated label per image
+    label_list = [l.strip() for l in labels.split(",") if l.strip()]
+    if len(label_list) == 1:
+        label_list = label_list * len(images)
+    if len(label_list) != len(images):
+        raise HTTPException(status_code=400, detail="Il faut un label, ou un label par image")
+    uploads = [(await image.read(), image.filename) for image in images]
+    start = time.perf_counter()
+    ids = await get_executor("clip").run(_ingest, uploads, label_list)
+    elapsed = time.perf_counter() - start
+    return {"ids": ids, "count": len(ids), "seconds": elapsed, "images_per_second": len(ids) / elapsed if elapsed else None}
+
+@router.delete("/items")
+async def delete_items(
+    ids: str = Query(..., description="comma-separated catalogue ids"),
+    _: None = Depends(require_admin_token),
+    _models: None = Depends(model_registry.requires("clip", authenticated=False))
+):
+    try:
+        id_list = [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids doit être une liste d'entiers")
+    removed = FashionClipSingleton.get_instance().catalogue.delete(id_list)
+    return {"removed": removed}
+
+@router.post("/snapshot")
+async def save_snapshot(
+    _: None = Depends(require_admin_token),
+    _models: None = Depends(model_registry.requires("clip", authenticated=False))
+):
+    # Compacts pending items and persists embeddings, metadata and index to app/data
+    version = await run_in_threadpool(FashionClipSingleton.get_instance().catalogue.save)
+    return {"version": version}
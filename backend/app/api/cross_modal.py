@@ -1,9 +1,33 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends
+import os
+import json
+import logging
+from typing import List
+from fastapi import APIRouter, UploadFile, File, Form, Query, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from PIL import UnidentifiedImageError
 from app.models.fashion_clip import FashionClipSingleton
+from app.models.registry import model_registry
 from app.schemas.cross_modal import SearchResponse
-from app.utils.credits import check_and_decrement_credit
+from app.utils.cache import result_cache
+from app.utils.credits import charge_credits, check_and_decrement_credit, get_user_id_from_token, refund_credit
+from app.utils.executor import get_executor
+from app.utils import metrics
+
+# Batch search: maximum number of queries per request, and queries per index search / streamed chunk
+SEARCH_BATCH_MAX_QUERIES = int(os.environ.get("SEARCH_BATCH_MAX_QUERIES", "10000"))
+SEARCH_BATCH_CHUNK = int(os.environ.get("SEARCH_BATCH_CHUNK", "1024"))
+# Batch search billing: one credit per this many queries (1 = same price as /search per query)
+SEARCH_BATCH_QUERIES_PER_CREDIT = max(1, int(os.environ.get("SEARCH_BATCH_QUERIES_PER_CREDIT", "1")))
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+batch_chunk_errors = metrics.REGISTRY.register(metrics.Counter(
+    "fv_search_batch_chunk_errors_total", "Batch search chunks that failed after the response started.", ("status",)))
+
+def _parse_labels(label: str):
+    labels = [l.strip() for l in label.split(",") if l.strip()] if label else []
+    return labels or None
 
 @router.post("/", response_model=SearchResponse)
 async def cross_modal_search(
@@ -11,8 +35,155 @@ async def cross_modal_search(
     text: str = Form(None),
     alpha: float = Form(0.5),
     top_k: int = Form(6),
+    alphas: str = Form(None),
+    nprobe: int = Form(None),
+    ef_search: int = Form(None),
+    label: str = Form(None),
+    _models: None = Depends(model_registry.requires("clip")),
+    user_id: str = Depends(check_and_decrement_credit)
+):
+    # alphas: comma-separated weights, e.g. "0.2,0.5,0.8" (image+text queries only)
+    # label: only return catalogue items with this label (comma-separated for several)
+    labels = _parse_labels(label)
+    try:
+        alpha_list = [float(a) for a in alphas.split(",") if a.strip()] if alphas else []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="alphas doit être une liste de nombres séparés par des virgules")
+    multi_alpha = bool(alpha_list) and bool(image) and bool(text)
+
+    contents = await image.read() if image else b""
+    clip = FashionClipSingleton.get_instance()
+    cache_key = result_cache.make_key("search", contents, text=text, alpha=alpha, top_k=top_k,
+                                      alphas=alpha_list if multi_alpha else None, nprobe=nprobe, ef_search=ef_search,
+                                      labels=labels, catalogue=clip.catalogue.cache_tag())
+    response = result_cache.get(cache_key)
+    if response is None:
+        if multi_alpha:
+            per_alpha = await get_executor("clip").run(clip.search_combined_alphas, contents, text, alpha_list, top_k,
+                                                      nprobe=nprobe, ef_search=ef_search, labels=labels)
+            response = {
+                "results": per_alpha[0],
+                "results_by_alpha": [{"alpha": a, "results": r} for a, r in zip(alpha_list, per_alpha)],
+            }
+        else:
+            response = {"results": await get_executor("clip").run(clip.search, contents or None, text, alpha, top_k,
+                                                               nprobe=nprobe, ef_search=ef_search, labels=labels)}
+        result_cache.put(cache_key, response)
+    return response
+
+
+def _search_chunk(queries, top_k, batch_size, nprobe, ef_search, labels=None):
+    # queries: (index, "text" | "image", text or (filename, bytes)); runs in the CLIP pool
+    clip = FashionClipSingleton.get_instance()
+    texts, images, lines = [], [], []
+    for index, kind, query in queries:
+        if kind == "text":
+            texts.append((index, query))
+            continue
+        filename, contents = query
+        try:
+            images.append((index, filename, clip.decode_image(contents)))
+        except UnidentifiedImageError:
+            lines.append({"index": index, "type": "image", "query": filename, "error": "image invalide"})
+    results = clip.search_batch(
+        [t for _, t in texts], [img for _, _, img in images], top_k, batch_size=batch_size,
+        nprobe=nprobe, ef_search=ef_search, labels=labels)
+    lines += [{"index": index, "type": "text", "query": text, "results": r}
+              for (index, text), r in zip(texts, results)]
+    lines += [{"index": index, "type": "image", "query": filename, "results": r}
+              for (index, filename, _), r in zip(images, results[len(texts):])]
+    return sorted(lines, key=lambda line: line["index"])
+
+def _ndjson(lines):
+    return "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines)
+
+@router.post("/batch")
+async def batch_search(
+    texts: List[str] = Form(None),
+    images: List[UploadFile] = File(None),
+    top_k: int = Form(6),
+    batch_size: int = Form(64),
+    nprobe: int = Form(None),
+    ef_search: int = Form(None),
+    label: str = Form(None),
+    _models: None = Depends(model_registry.requires("clip")),
+    user_id: str = Depends(get_user_id_from_token)
+):
+    # Many text and/or image queries in one request; one NDJSON line per query, texts first
+    # Billed per query (SEARCH_BATCH_QUERIES_PER_CREDIT queries per credit) once the batch is validated
+    count = len(texts or []) + len(images or [])
+    if not count:
+        raise HTTPException(status_code=400, detail="Aucune requête")
+    if count > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"Au plus {SEARCH_BATCH_MAX_QUERIES} requêtes par appel")
+    queries = [(i, "text", text) for i, text in enumerate(texts or [])]
+    for image in images or []:
+        queries.append((len(queries), "image", (image.filename, await image.read())))
+    batch_size = max(1, min(batch_size, 256))
+    labels = _parse_labels(label)
+    chunks = [queries[start:start + SEARCH_BATCH_CHUNK] for start in range(0, len(queries), SEARCH_BATCH_CHUNK)]
+    cost = -(-count // SEARCH_BATCH_QUERIES_PER_CREDIT)
+    await charge_credits(user_id, cost)
+
+    # Billed per answered query: undecodable images and queries left unserved by an error are refunded
+    pool = get_executor("clip")
+    served = 0
+
+    async def run_chunk(chunk):
+        nonlocal served
+        lines = await pool.run(_search_chunk, chunk, top_k, batch_size, nprobe, ef_search, labels)
+        served += sum("results" in line for line in lines)
+        return lines
+
+    async def refund_unserved():
+        await refund_credit(user_id, cost - -(-served // SEARCH_BATCH_QUERIES_PER_CREDIT))
+
+    # The first chunk runs before the response starts, so a saturated pool is still a plain 503
+    try:
+        first = await run_chunk(chunks[0])
+    except Exception:
+        await refund_unserved()
+        raise
+
+    async def stream():
+        # Later chunks are streamed as they complete; the model pool slot is released between chunks.
+        # Once the headers are sent an error can only be reported in the body: it is the last line.
+        # Server-Timing, a header as well, only covers the first chunk.
+        try:
+            yield _ndjson(first)
+            for chunk in chunks[1:]:
+                try:
+                    lines = await run_chunk(chunk)
+                except HTTPException as e:
+                    batch_chunk_errors.inc(status=e.status_code)
+                    yield _ndjson([{"index": chunk[0][0], "status": e.status_code, "error": e.detail}])
+                    return
+                except Exception:
+                    batch_chunk_errors.inc(status=500)
+                    logger.exception("Batch search chunk failed")
+                    yield _ndjson([{"index": chunk[0][0], "status": 500, "error": "Erreur interne"}])
+                    return
+                yield _ndjson(lines)
+        finally:
+            await refund_unserved()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.get("/similar", response_model=SearchResponse)
+async def similar_items(
+    id: int = Query(None, description="catalogue id"),
+    image_path: str = Query(None, description="catalogue image path, as returned in results (or its /static URL)"),
+    top_k: int = Query(6),
+    _models: None = Depends(model_registry.requires("clip")),
     user_id: str = Depends(check_and_decrement_credit)
 ):
-    # TODO: Implement logic in FashionClipSingleton
-    results = FashionClipSingleton.get_instance().search(image, text, alpha, top_k)
+    # "More like this" for catalogue items: the precomputed neighbour table, or an index search when it is stale
+    if id is None and not image_path:
+        raise HTTPException(status_code=400, detail="id ou image_path requis")
+    if image_path and image_path.startswith("/static/"):
+        image_path = image_path[len("/static/"):]
+    results = await get_executor("clip").run(FashionClipSingleton.get_instance().similar_items,
+                                             item_id=id, image_path=image_path, top_k=top_k)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Article inconnu")
     return {"results": results}
@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.models.registry import MODEL_LOADING, model_registry
+
+router = APIRouter()
+
+@router.get("/live")
+async def live():
+    # The process is up and serving HTTP (models may still be loading)
+    return {"status": "alive"}
+
+@router.get("/ready")
+async def ready():
+    # 200 once every model served by this replica is loaded (lazy replicas: as long as none failed), 503 before
+    is_ready = model_registry.is_ready()
+    body = {"ready": is_ready, "loading": MODEL_LOADING, "enabled": model_registry.enabled,
+            "models": model_registry.status()}
+    return JSONResponse(body, status_code=200 if is_ready else 503)
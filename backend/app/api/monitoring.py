@@ -0,0 +1,26 @@
+from fastapi import APIRouter
+from app.models.fashion_clip import FashionClipSingleton
+from app.utils.cache import result_cache
+from app.utils.executor import executors_stats
+
+router = APIRouter()
+
+@router.get("/batching")
+async def batching_stats():
+    # Queue depth, realized batch size and wait time of the CLIP micro-batchers
+    return {"batchers": FashionClipSingleton.get_instance().batching_stats()}
+
+@router.get("/cache")
+async def cache_stats():
+    # Hit/miss/eviction counters of the result cache
+    return result_cache.stats()
+
+@router.get("/executors")
+async def executor_stats():
+    # In-flight / queued / rejected calls per model pool
+    return {"executors": executors_stats()}
+
+@router.get("/label-cache")
+async def label_cache_stats():
+    # Size and hit rate of the multi-label text-embedding cache
+    return FashionClipSingleton.get_instance().label_cache.stats()
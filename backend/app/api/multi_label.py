@@ -1,8 +1,11 @@
 from fastapi import APIRouter, UploadFile, File, Form, Depends
 from typing import List
 from app.models.fashion_clip import FashionClipSingleton
+from app.models.registry import model_registry
 from app.schemas.multi_label import MultiLabelResponse
+from app.utils.cache import result_cache
 from app.utils.credits import check_and_decrement_credit
+from app.utils.executor import get_executor
 
 router = APIRouter()
 
@@ -10,10 +13,15 @@ router = APIRouter()
 async def multi_label_classification(
     image: UploadFile = File(...),
     labels: str = Form(...),
+    _models: None = Depends(model_registry.requires("clip")),
     user_id: str = Depends(check_and_decrement_credit)
 ):
     # labels is a comma-separated string
     label_list = [l.strip() for l in labels.split(",") if l.strip()]
-    # TODO: Implement logic in FashionClipSingleton
-    results = FashionClipSingleton.get_instance().multi_label(image, label_list)
+    contents = await image.read()
+    cache_key = result_cache.make_key("classify", contents, labels=label_list)
+    results = result_cache.get(cache_key)
+    if results is None:
+        results = await get_executor("clip").run(FashionClipSingleton.get_instance().multi_label, contents, label_list)
+        result_cache.put(cache_key, results)
     return {"results": results}
@@ -1,20 +1,30 @@
-from fastapi import APIRouter, UploadFile, File, Depends
+from fastapi import APIRouter, UploadFile, File, Form, Depends
 from app.models.object_detection import FashionObjectDetector
+from app.models.registry import model_registry
 from app.schemas.object_detection import ObjectDetectionResponse, DetectedObject
-from PIL import Image
-import io
+from app.utils.cache import result_cache
 from app.utils.credits import check_and_decrement_credit
+from app.utils.executor import get_executor
 
 router = APIRouter()
 
+def _detect_bytes(contents: bytes, threshold: float):
+    # Decoding is CPU-heavy too, so it runs in the detector pool with the forward
+    return FashionObjectDetector.get_instance().detect(contents, threshold=threshold)
+
 @router.post("/", response_model=ObjectDetectionResponse)
 async def detect_fashion_objects(
     image: UploadFile = File(...),
+    threshold: float = Form(0.3),
+    _models: None = Depends(model_registry.requires("detector")),
     user_id: str = Depends(check_and_decrement_credit)
 ):
     contents = await image.read()
-    pil_image = Image.open(io.BytesIO(contents)).convert("RGB")
-    detected = FashionObjectDetector.get_instance().detect(pil_image)
+    cache_key = result_cache.make_key("detect", contents, threshold=threshold)
+    detected = result_cache.get(cache_key)
+    if detected is None:
+        detected = await get_executor("detector").run(_detect_bytes, contents, threshold)
+        result_cache.put(cache_key, detected)
     return ObjectDetectionResponse(
         detected_objects=[DetectedObject(**obj) for obj in detected]
-    ) 
\ No newline at end of file
+    )
@@ -1,15 +1,50 @@
-from fastapi import APIRouter, UploadFile, File, Depends
+from fastapi import APIRouter, UploadFile, File, Form, Header, Depends, HTTPException
+from fastapi.responses import Response
 from app.models.schp import SCHPSingleton
+from app.models.registry import model_registry
 from app.schemas.segmentation import SegmentationResponse
+from app.utils.cache import result_cache
 from app.utils.credits import check_and_decrement_credit
+from app.utils.executor import get_executor
+
+# Accept values answered with the raw label map of a single parser instead of JSON
+BINARY_MEDIA_TYPES = ("image/png", "application/octet-stream")
 
 router = APIRouter()
 
-@router.post("/", response_model=SegmentationResponse)
+def _binary_media_type(accept: str):
+    for media_type in (part.split(";")[0].strip() for part in (accept or "").split(",")):
+        if media_type in BINARY_MEDIA_TYPES:
+            return media_type
+    return None
+
+# Fields of the other formats and of a parser that was not requested are left out, not sent as null
+@router.post("/", response_model=SegmentationResponse, response_model_exclude_none=True)
 async def segment_image(
     image: UploadFile = File(...),
+    parsers: str = Form("atr,lip"),
+    format: str = Form("color_png"),
+    max_size: int = Form(None),
+    accept: str = Header(None),
+    _models: None = Depends(model_registry.requires("schp")),
     user_id: str = Depends(check_and_decrement_credit)
 ):
-    # TODO: Implement logic in SCHPSingleton
-    result = SCHPSingleton.get_instance().segment(image)
+    # format: color_png | color_png_palette | label_png | rle | polygons | labels; max_size: longest side of the returned masks
+    parser_list = [p.strip().lower() for p in parsers.split(",") if p.strip()]
+    contents = await image.read()
+    media_type = _binary_media_type(accept)
+    if media_type is not None:
+        if len(set(parser_list)) != 1:
+            raise HTTPException(status_code=400, detail="Une réponse binaire ne contient qu'un parser (parsers=atr ou parsers=lip)")
+        body, headers = await get_executor("schp").run(
+            SCHPSingleton.get_instance().segment_binary, contents, parser_list[0], media_type, max_size=max_size)
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    cache_key = result_cache.make_key("segment", contents, parsers=sorted(set(parser_list)), format=format,
+                                      max_size=max_size)
+    result = result_cache.get(cache_key)
+    if result is None:
+        result = await get_executor("schp").run(SCHPSingleton.get_instance().segment, contents, parser_list,
+                                                output_format=format, max_size=max_size)
+        result_cache.put(cache_key, result)
     return result
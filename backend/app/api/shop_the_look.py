@@ -0,0 +1,70 @@
+import time
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from PIL import UnidentifiedImageError
+from app.models.fashion_clip import FashionClipSingleton
+from app.models.object_detection import FashionObjectDetector
+from app.models.registry import model_registry
+from app.schemas.shop_the_look import ShopTheLookResponse
+from app.utils.cache import result_cache
+from app.utils.credits import check_and_decrement_credit
+from app.utils.executor import get_executor
+from app.utils.image import crop_boxes, load_image
+from app.utils.metrics import timed
+
+router = APIRouter()
+
+def _search_crops(decoded, detected, padding, top_k, labels):
+    # Crops come from the already-decoded image; one batched image forward and one index search for all of them
+    crops = crop_boxes(decoded, [obj["box"] for obj in detected], padding=padding)
+    clip = FashionClipSingleton.get_instance()
+    return clip.search_batch(images=crops, top_k=top_k, batch_size=max(1, len(crops)), labels=labels)
+
+@router.post("/", response_model=ShopTheLookResponse)
+async def shop_the_look(
+    image: UploadFile = File(...),
+    top_k: int = Form(6),
+    threshold: float = Form(0.3),
+    max_objects: int = Form(10),
+    padding: float = Form(0.05),
+    label: str = Form(None),
+    _models: None = Depends(model_registry.requires("detector", "clip")),
+    user_id: str = Depends(check_and_decrement_credit)
+):
+    # Detects the garments of an outfit photo and returns similar catalogue items for each of them
+    # max_objects: highest-scoring boxes kept; padding: context added around each box (fraction of its size)
+    if max_objects < 1:
+        raise HTTPException(status_code=400, detail="max_objects doit être supérieur ou égal à 1")
+    labels = [l.strip() for l in label.split(",") if l.strip()] if label else None
+
+    begin = time.perf_counter()
+    contents = await image.read()
+    catalogue = FashionClipSingleton.get_instance().catalogue
+    cache_key = result_cache.make_key("shop_the_look", contents, top_k=top_k, threshold=threshold,
+                                      max_objects=max_objects, padding=padding, labels=labels,
+                                      catalogue=catalogue.cache_tag())
+    response = result_cache.get(cache_key)
+    if response is not None:
+        return {**response, "timings_ms": {"total": (time.perf_counter() - begin) * 1000}, "cached": True}
+
+    # Decoded on the pixel budget only (no min_side): the crops need more resolution than the detector
+    start = time.perf_counter()
+    try:
+        decoded = await run_in_threadpool(load_image, contents)
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Le fichier uploadé n'est pas une image valide ou est corrompu.")
+    timings = {"decode": (time.perf_counter() - start) * 1000}
+
+    detector = FashionObjectDetector.get_instance()
+    detected, timings["detect"] = await get_executor("detector").run(timed, detector.detect, decoded,
+                                                                       threshold=threshold)
+    detected = sorted(detected, key=lambda obj: -obj["score"])[:max_objects]
+    results = []
+    if detected:
+        results, timings["search"] = await get_executor("clip").run(timed, _search_crops, decoded, detected,
+                                                                      padding, top_k, labels)
+
+    response = {"items": [{**obj, "results": found} for obj, found in zip(detected, results)]}
+    result_cache.put(cache_key, response)
+    timings["total"] = (time.perf_counter() - begin) * 1000
+    return {**response, "timings_ms": timings, "cached": False}
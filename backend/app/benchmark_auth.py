@@ -0,0 +1,53 @@
+# Auth overhead per request: get_user_id_from_token with and without the verified-token cache
+#
+#   python -m app.benchmark_auth --requests 20000 --tokens 100
+import os
+import time
+import uuid
+import argparse
+
+os.environ.setdefault("SUPABASE_JWT_SECRET", "benchmark-secret-" + "x" * 32)
+
+from jose import jwt
+from app.utils import credits
+
+
+def make_tokens(n):
+    now = int(time.time())
+    return [
+        jwt.encode({"sub": str(uuid.uuid4()), "aud": "authenticated", "role": "authenticated",
+                    "iat": now, "exp": now + 3600}, os.environ["SUPABASE_JWT_SECRET"], algorithm="HS256")
+        for _ in range(n)
+    ]
+
+
+def run(tokens, n_requests, backend, cache_size):
+    credits.JWT_BACKEND = backend
+    credits.JWT_CACHE_SIZE = cache_size
+    credits._token_cache.clear()
+    headers = [f"Bearer {token}" for token in tokens]
+    start = time.perf_counter()
+    for i in range(n_requests):
+        credits.get_user_id_from_token(headers[i % len(headers)])
+    return (time.perf_counter() - start) / n_requests * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JWT verification benchmark")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=100, help="distinct bearer tokens cycled through")
+    args = parser.parse_args()
+
+    tokens = make_tokens(args.tokens)
+    backends = ["jose", "hmac"]
+    try:
+        import jwt as pyjwt  # noqa: F401
+        backends.append("pyjwt")
+    except ImportError:
+        pass
+
+    print(f"--- {args.requests} requests, {args.tokens} distinct tokens ---")
+    print(f"{'backend':>8} {'no cache us/req':>16} {'cache us/req':>13}")
+    for backend in backends:
+        print(f"{backend:>8} {run(tokens, args.requests, backend, 0):>16.1f} "
+              f"{run(tokens, args.requests, backend, 10000):>13.1f}")
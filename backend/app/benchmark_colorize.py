@@ -0,0 +1,88 @@
+# Micro-benchmark: segmentation mask colourization (legacy per-label loop vs lookup table vs palette image)
+#
+#   python -m app.benchmark_colorize --sizes 512x768,1536x2048,3024x4032 --runs 5
+import io
+import argparse
+import time
+import numpy as np
+from PIL import Image
+
+from app.models.schp import ATR_MAPPING, LIP_MAPPING, LABEL_COLORS, SCHPSingleton
+
+
+def timeit(fn, runs):
+    fn()  # warm-up
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000.0
+
+
+def legacy_colorize(mask, mapping):
+    # Previous implementation: hex parsing and one boolean assignment over the image per label
+    h, w = mask.shape
+    color_mask = np.zeros((h, w, 3), dtype=np.uint8)
+    color_map = {}
+    for idx in np.unique(mask):
+        label = mapping.get(idx, None)
+        if label:
+            hex_color = LABEL_COLORS.get(label, "#CCCCCC")
+            color = tuple(int(hex_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
+            color_mask[mask == idx] = color
+            color_map[label] = hex_color
+    return Image.fromarray(color_mask).convert('RGB'), color_map
+
+
+def synthetic_mask(w, h, num_classes, seed=0):
+    # Blocky label regions (every class present), closer to a parsing result than per-pixel noise
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, num_classes, size=(max(1, h // 64), max(1, w // 64)), dtype=np.uint8)
+    coarse.flat[:num_classes] = np.arange(num_classes)
+    return np.asarray(Image.fromarray(coarse).resize((w, h), Image.NEAREST))
+
+
+def png_bytes(img):
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def bench(sizes, mapping, name, runs):
+    # generate_color_mask_simple does not use the models, no need to load the checkpoints
+    schp = SCHPSingleton.__new__(SCHPSingleton)
+    print(f"--- {name} ({len(mapping)} labels) ---")
+    print(f"{'image':>12} {'legacy ms':>10} {'lut ms':>8} {'palette ms':>11} "
+          f"{'legacy+png ms':>14} {'lut+png ms':>11} {'palette+png ms':>15} {'rgb KB':>7} {'P KB':>6}")
+    for w, h in sizes:
+        mask = synthetic_mask(w, h, len(mapping))
+        legacy_img, legacy_map = legacy_colorize(mask, mapping)
+        lut_img, lut_map = schp.generate_color_mask_simple(mask, mapping)
+        palette_img, palette_map = schp.generate_color_mask_simple(mask, mapping, palette=True)
+        assert legacy_map == lut_map == palette_map
+        assert np.array_equal(np.asarray(legacy_img), np.asarray(lut_img))
+        assert np.array_equal(np.asarray(legacy_img), np.asarray(palette_img.convert("RGB")))
+
+        legacy = timeit(lambda: legacy_colorize(mask, mapping), runs)
+        lut = timeit(lambda: schp.generate_color_mask_simple(mask, mapping), runs)
+        palette = timeit(lambda: schp.generate_color_mask_simple(mask, mapping, palette=True), runs)
+        legacy_png = timeit(lambda: png_bytes(legacy_colorize(mask, mapping)[0]), runs)
+        lut_png = timeit(lambda: png_bytes(schp.generate_color_mask_simple(mask, mapping)[0]), runs)
+        palette_png = timeit(lambda: png_bytes(schp.generate_color_mask_simple(mask, mapping, palette=True)[0]), runs)
+        print(f"{f'{w}x{h}':>12} {legacy:>10.1f} {lut:>8.1f} {palette:>11.1f} {legacy_png:>14.1f} "
+              f"{lut_png:>11.1f} {palette_png:>15.1f} {len(png_bytes(legacy_img)) / 1024:>7.0f} {len(png_bytes(palette_img)) / 1024:>6.0f}")
+
+
+def parse_sizes(value):
+    return [tuple(int(v) for v in size.split("x")) for size in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segmentation mask colourization micro-benchmark")
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes("512x768,1536x2048,3024x4032"))
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    bench(args.sizes, ATR_MAPPING, "ATR", args.runs)
+    bench(args.sizes, LIP_MAPPING, "LIP", args.runs)
@@ -0,0 +1,71 @@
+# FAISS index benchmark: recall@k against exact search and QPS for each index type / search knob
+#
+#   python -m app.benchmark_faiss                      # catalogue embeddings.npy
+#   python -m app.benchmark_faiss --synthetic 1000000  # random normalized vectors
+import os
+import time
+import argparse
+import numpy as np
+import faiss
+
+from app.utils.faiss_utils import build_index, search_faiss
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    hits = sum(len(np.intersect1d(f[f >= 0], t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def timed_search(index, queries, k, **knobs):
+    start = time.perf_counter()
+    _, I = search_faiss(index, queries, k, **knobs)
+    return I, len(queries) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    data_dir = os.path.join(os.path.dirname(__file__), "data")
+    parser = argparse.ArgumentParser(description="FAISS recall / QPS benchmark")
+    parser.add_argument("--embeddings", default=os.path.join(data_dir, "embeddings.npy"))
+    parser.add_argument("--synthetic", type=int, default=0, help="use N random vectors instead of embeddings.npy")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobes", default="1,4,16,64")
+    parser.add_argument("--ef-searches", default="16,32,64,128")
+    parser.add_argument("--pq-m", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=0, help="OpenMP threads (0 = faiss default)")
+    args = parser.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        xb = rng.standard_normal((args.synthetic, args.dim), dtype=np.float32)
+    else:
+        xb = np.load(args.embeddings).astype("float32")
+    xb /= np.linalg.norm(xb, axis=1, keepdims=True)
+    # Queries: perturbed catalogue vectors, like real "similar item" traffic
+    xq = xb[rng.choice(len(xb), args.queries, replace=False)] + 0.05 * rng.standard_normal(
+        (args.queries, xb.shape[1]), dtype=np.float32)
+    xq /= np.linalg.norm(xq, axis=1, keepdims=True)
+
+    print(f"--- {len(xb)} vectors, dim {xb.shape[1]}, {args.queries} queries, k={args.k} ---")
+    flat, _ = build_index(xb, "flat")
+    truth, flat_qps = timed_search(flat, xq, args.k)
+    print(f"{'index':>10} {'knob':>14} {'recall@k':>9} {'QPS':>10} {'build s':>8}")
+    print(f"{'flat':>10} {'-':>14} {1.0:>9.3f} {flat_qps:>10.0f} {'-':>8}")
+
+    sweeps = {
+        "ivf_flat": ("nprobe", [int(v) for v in args.nprobes.split(",")]),
+        "ivf_pq": ("nprobe", [int(v) for v in args.nprobes.split(",")]),
+        "hnsw": ("ef_search", [int(v) for v in args.ef_searches.split(",")]),
+    }
+    for index_type, (knob, values) in sweeps.items():
+        start = time.perf_counter()
+        index, params = build_index(xb, index_type, pq_m=args.pq_m)
+        build_seconds = time.perf_counter() - start
+        for value in values:
+            found, qps = timed_search(index, xq, args.k, **{knob: value})
+            print(f"{index_type:>10} {f'{knob}={value}':>14} {recall_at_k(found, truth):>9.3f} {qps:>10.0f} "
+                  f"{build_seconds:>8.1f}")
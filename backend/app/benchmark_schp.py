@@ -0,0 +1,99 @@
+# Micro-benchmark: legacy SCHP post-processing vs the vectorized inference path
+#
+#   python -m app.benchmark_schp --sizes 512x768,1536x2048,3024x4032 --runs 5
+#   python -m app.benchmark_schp --ckpt app/data/checkpoints/exp-schp-201908301523-atr.pth
+import argparse
+import time
+import numpy as np
+import torch
+
+from app.data.SCHP.utils.transforms import transform_logits, transform_logits_argmax, transform_parsing
+
+
+def xywh2cs(w, h, aspect_ratio):
+    center = np.array([(w - 1) * 0.5, (h - 1) * 0.5], dtype=np.float32)
+    bw, bh = w - 1, h - 1
+    if bw > aspect_ratio * bh:
+        bh = bw * 1.0 / aspect_ratio
+    elif bw < aspect_ratio * bh:
+        bw = bh * aspect_ratio
+    return center, np.array([bw, bh], dtype=np.float32)
+
+
+def timeit(fn, runs):
+    fn()  # warm-up
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000.0
+
+
+def bench_postprocess(sizes, num_classes, input_size, runs, device):
+    print(f"--- Post-processing only ({num_classes} classes, network {input_size[0]}x{input_size[1]}) ---")
+    # vector: grouped warp at every size; auto: what parse() uses (per-class loop below VECTORIZED_MIN_PIXELS)
+    print(f"{'image':>12} {'legacy ms':>10} {'vector ms':>10} {'auto ms':>8} {'argmax1 ms':>11} {'agree %':>8}")
+    logits = torch.randn(num_classes, *input_size, device=device)
+    for w, h in sizes:
+        c, s = xywh2cs(w, h, input_size[1] * 1.0 / input_size[0])
+
+        def legacy():
+            out = transform_logits(logits.permute(1, 2, 0).cpu().numpy(), c, s, w, h, input_size=input_size)
+            return np.argmax(out, axis=2)
+
+        def vectorized():
+            return transform_logits_argmax(logits, c, s, w, h, input_size=input_size, min_pixels=0)
+
+        def auto():
+            return transform_logits_argmax(logits, c, s, w, h, input_size=input_size)
+
+        def argmax_first():
+            parsing = logits.argmax(dim=0).to(torch.uint8).cpu().numpy()
+            return transform_parsing(parsing, c, s, w, h, input_size=input_size)
+
+        agree = (legacy() == vectorized()).mean() * 100.0
+        print(f"{f'{w}x{h}':>12} {timeit(legacy, runs):>10.1f} {timeit(vectorized, runs):>10.1f} "
+              f"{timeit(auto, runs):>8.1f} {timeit(argmax_first, runs):>11.1f} {agree:>8.2f}")
+
+
+def bench_model(ckpt, sizes, batch, runs, device):
+    from PIL import Image
+    from app.data.SCHP import SCHP
+
+    schp = SCHP(ckpt_path=ckpt, device=device)
+    print(f"--- Full parser ({ckpt}, batch {batch}) ---")
+    print(f"{'image':>12} {'legacy ms':>10} {'parse ms':>10} {'argmax1 ms':>11}")
+    for w, h in sizes:
+        images = [Image.fromarray(np.random.randint(0, 255, (h, w, 3), dtype=np.uint8)) for _ in range(batch)]
+
+        def legacy():
+            # Previous path: autograd enabled, per-channel warpAffine, numpy argmax
+            inputs, metas = zip(*[schp.preprocess(img) for img in images])
+            outputs = schp.upsample(schp.model(torch.cat(inputs, dim=0))).permute(0, 2, 3, 1)
+            for output, meta in zip(outputs, metas):
+                logits = transform_logits(output.data.cpu().numpy(), meta['center'], meta['scale'],
+                                          meta['width'], meta['height'], input_size=schp.input_size)
+                np.argmax(logits, axis=2)
+
+        print(f"{f'{w}x{h}':>12} {timeit(legacy, runs):>10.1f} {timeit(lambda: schp.parse(images), runs):>10.1f} "
+              f"{timeit(lambda: schp.parse(images, argmax_first=True), runs):>11.1f}")
+
+
+def parse_sizes(value):
+    return [tuple(int(v) for v in size.split("x")) for size in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SCHP inference micro-benchmark")
+    parser.add_argument("--sizes", type=parse_sizes, default=parse_sizes("512x768,1536x2048,3024x4032"))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ckpt", default=None, help="SCHP checkpoint; when set, the full model is benchmarked too")
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    bench_postprocess(args.sizes, 18, [512, 512], args.runs, args.device)
+    bench_postprocess(args.sizes, 20, [473, 473], args.runs, args.device)
+    if args.ckpt:
+        bench_model(args.ckpt, args.sizes, args.batch, args.runs, args.device)
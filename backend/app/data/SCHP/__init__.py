@@ -1,7 +1,8 @@
 from . import networks
-from .utils.transforms import get_affine_transform, transform_logits
+from .utils.transforms import get_affine_transform, transform_logits, transform_logits_argmax, transform_parsing
 
 from collections import OrderedDict
+from contextlib import nullcontext
 import torch
 import numpy as np
 import cv2
@@ -124,6 +125,9 @@ class SCHP:
         elif isinstance(image, Image.Image):
             # to cv2 format
             img = np.array(image)
+        elif isinstance(image, np.ndarray):
+            # already decoded (shared between parsers)
+            img = image
     
         h, w, _ = img.shape
         # Get person center and scale
@@ -149,31 +153,46 @@ class SCHP:
         return input, meta
 
 
-    def __call__(self, image_or_path):
-        if isinstance(image_or_path, list):
-            image_list = []
-            meta_list = []
-            for image in image_or_path:
+    def parse(self, images, argmax_first=False, timer=None):
+        """Batched inference returning one (H, W) uint8 label map per image.
+
+        Runs without autograd. With `argmax_first`, the argmax is taken at
+        network resolution and the label map is warped back with nearest
+        interpolation, which is much cheaper on large images. `timer(name)`,
+        if given, returns a context manager wrapped around each step
+        ("preprocess", "forward", "postprocess").
+        """
+        stage = timer or (lambda name: nullcontext())
+        image_list = []
+        meta_list = []
+        with stage("preprocess"):
+            for image in images:
                 image, meta = self.preprocess(image)
                 image_list.append(image)
                 meta_list.append(meta)
-            image = torch.cat(image_list, dim=0)
-        else:
-            image, meta = self.preprocess(image_or_path)
-            meta_list = [meta]
-                
-        output = self.model(image)
-        # upsample_outputs = self.upsample(output[0][-1])
-        upsample_outputs = self.upsample(output)
-        upsample_outputs = upsample_outputs.permute(0, 2, 3, 1)  # BCHW -> BHWC
 
+        parsing_results = []
+        with torch.inference_mode():
+            with stage("forward"):
+                output = self.model(torch.cat(image_list, dim=0))
+                upsample_outputs = self.upsample(output)
+            for upsample_output, meta in zip(upsample_outputs, meta_list):
+                c, s, w, h = meta['center'], meta['scale'], meta['width'], meta['height']
+                with stage("postprocess"):
+                    if argmax_first:
+                        parsing = upsample_output.argmax(dim=0).to(torch.uint8).cpu().numpy()
+                        parsing_result = transform_parsing(parsing, c, s, w, h, input_size=self.input_size)
+                    else:
+                        parsing_result = transform_logits_argmax(upsample_output, c, s, w, h, input_size=self.input_size)
+                parsing_results.append(parsing_result)
+        return parsing_results
+
+    def __call__(self, image_or_path, argmax_first=False):
+        images = image_or_path if isinstance(image_or_path, list) else [image_or_path]
         output_img_list = []
-        for upsample_output, meta in zip(upsample_outputs, meta_list):
-            c, s, w, h = meta['center'], meta['scale'], meta['width'], meta['height']
-            logits_result = transform_logits(upsample_output.data.cpu().numpy(), c, s, w, h, input_size=self.input_size)
-            parsing_result = np.argmax(logits_result, axis=2)
+        for parsing_result in self.parse(images, argmax_first=argmax_first):
             output_img = Image.fromarray(np.asarray(parsing_result, dtype=np.uint8))
             output_img.putpalette(self.palette)
             output_img_list.append(output_img)
 
-        return output_img_list[0] if len(output_img_list) == 1 else output_img_list
\ No newline at end of file
+        return output_img_list[0] if len(output_img_list) == 1 else output_img_list
@@ -97,6 +97,80 @@ def transform_logits(logits, center, scale, width, height, input_size):
     return target_logits
 
 
+# CPU outputs below this many pixels keep the per-class loop: the grouped warp only wins on
+# larger images (crossover around 576x864 with 18-20 classes, see app/benchmark_schp.py)
+VECTORIZED_MIN_PIXELS = 500_000
+
+
+def transform_logits_argmax(logits, center, scale, width, height, input_size, rows_per_chunk=256,
+                            min_pixels=VECTORIZED_MIN_PIXELS):
+    """Inverse warp of (C, H, W) logits followed by argmax, without the per-class loop.
+
+    Equivalent to `transform_logits` + `np.argmax(axis=2)`. On GPU every class
+    is resampled in one `grid_sample` call; on CPU classes are warped four at a
+    time with `cv2.warpAffine` (its exact multi-channel path), for outputs of
+    at least `min_pixels` pixels (smaller ones use the per-class loop). Rows are
+    processed in chunks so the full-resolution logit volume is never
+    materialised. Returns a (height, width) uint8 label map.
+    """
+    width, height = int(width), int(height)
+    if logits.is_cuda:
+        return _transform_logits_argmax_torch(logits, center, scale, width, height, input_size, rows_per_chunk)
+
+    logits = logits.permute(1, 2, 0).cpu().numpy()
+    if width * height < min_pixels:
+        return np.argmax(transform_logits(logits, center, scale, width, height, input_size), axis=2).astype(np.uint8)
+    trans = get_affine_transform(center, scale, 0, input_size, inv=1)
+    # Groups are padded to 4 channels: 2/3-channel warps do not use the same interpolation path
+    groups = []
+    for i in range(0, logits.shape[2], 4):
+        group = logits[:, :, i:i + 4]
+        padding = [group[:, :, -1:]] * (4 - group.shape[2])
+        groups.append((np.ascontiguousarray(np.concatenate([group] + padding, axis=2)), group.shape[2]))
+    parsing = np.empty((height, width), dtype=np.uint8)
+    for start in range(0, height, rows_per_chunk):
+        rows = min(rows_per_chunk, height - start)
+        chunk_trans = trans.copy()
+        chunk_trans[1, 2] -= start
+        best_logit, best_class = None, None
+        offset = 0
+        for group, channels in groups:
+            warped = cv2.warpAffine(group, chunk_trans, (width, rows), flags=cv2.INTER_LINEAR,
+                                    borderMode=cv2.BORDER_CONSTANT, borderValue=0)[:, :, :channels]
+            group_class = warped.argmax(axis=2)
+            group_logit = np.take_along_axis(warped, group_class[:, :, None], axis=2)[:, :, 0]
+            if best_logit is None:
+                best_logit, best_class = group_logit, group_class
+            else:
+                better = group_logit > best_logit
+                best_logit = np.where(better, group_logit, best_logit)
+                best_class = np.where(better, group_class + offset, best_class)
+            offset += channels
+        parsing[start:start + rows] = best_class
+    return parsing
+
+
+def _transform_logits_argmax_torch(logits, center, scale, width, height, input_size, rows_per_chunk):
+    import torch.nn.functional as F
+
+    # warpAffine(inv transform) samples the source at the forward transform
+    trans = torch.as_tensor(get_affine_transform(center, scale, 0, input_size), dtype=torch.float32,
+                            device=logits.device)
+    in_h, in_w = logits.shape[-2:]
+    xs = torch.arange(width, dtype=torch.float32, device=logits.device)
+    logits = logits.unsqueeze(0)
+    parsing = torch.empty((height, width), dtype=torch.uint8, device=logits.device)
+    for start in range(0, height, rows_per_chunk):
+        ys = torch.arange(start, min(start + rows_per_chunk, height), dtype=torch.float32, device=logits.device)
+        gy, gx = torch.meshgrid(ys, xs, indexing='ij')
+        u = trans[0, 0] * gx + trans[0, 1] * gy + trans[0, 2]
+        v = trans[1, 0] * gx + trans[1, 1] * gy + trans[1, 2]
+        grid = torch.stack((2 * u / (in_w - 1) - 1, 2 * v / (in_h - 1) - 1), dim=-1).unsqueeze(0)
+        warped = F.grid_sample(logits, grid, mode='bilinear', padding_mode='zeros', align_corners=True)
+        parsing[start:start + ys.shape[0]] = warped[0].argmax(dim=0).to(torch.uint8)
+    return parsing.cpu().numpy()
+
+
 def get_affine_transform(center,
                          scale,
                          rot,
@@ -0,0 +1,83 @@
+# Catalogue ingestion CLI
+#
+# Live, through the running API (no restart):
+#   python -m app.ingest path/to/images --label jacket --api-url http://localhost:8000 --admin-token $TOKEN
+# Offline, writing app/data/ directly (picked up at the next start):
+#   python -m app.ingest path/to/images --label-from-dir
+import os
+import time
+import argparse
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def list_images(root):
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        paths.extend(os.path.join(dirpath, f) for f in sorted(filenames) if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+    return sorted(paths)
+
+
+def label_for(path, args):
+    return os.path.basename(os.path.dirname(path)) if args.label_from_dir else args.label
+
+
+def ingest_api(paths, args):
+    import requests
+
+    headers = {"X-Admin-Token": args.admin_token}
+    for start in range(0, len(paths), args.batch_size):
+        batch = paths[start:start + args.batch_size]
+        handles = [open(p, "rb") for p in batch]
+        try:
+            files = [("images", (os.path.basename(p), h)) for p, h in zip(batch, handles)]
+            data = {"labels": ",".join(label_for(p, args) for p in batch)}
+            r = requests.post(f"{args.api_url}/api/v1/catalogue/items", files=files, data=data, headers=headers)
+        finally:
+            for h in handles:
+                h.close()
+        r.raise_for_status()
+        print(f"[INGEST] {start + len(batch)}/{len(paths)} ({r.json()['images_per_second']:.1f} img/s server-side)")
+    if args.snapshot:
+        requests.post(f"{args.api_url}/api/v1/catalogue/snapshot", headers=headers).raise_for_status()
+
+
+def ingest_offline(paths, args):
+    import torch
+    from app.models.fashion_clip import FashionClipSingleton
+
+    clip = FashionClipSingleton.get_instance('cuda' if torch.cuda.is_available() else 'cpu')
+    data_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
+    for start in range(0, len(paths), args.batch_size):
+        batch = paths[start:start + args.batch_size]
+        images = [clip.decode_image(p) for p in batch]
+        # Paths inside app/data stay relative so /static can serve them
+        items = [{"label": label_for(p, args),
+                  "path": os.path.relpath(os.path.abspath(p), data_dir) if os.path.abspath(p).startswith(data_dir + os.sep) else os.path.abspath(p)}
+                 for p in batch]
+        clip.ingest(images, items, batch_size=args.batch_size)
+        print(f"[INGEST] {start + len(batch)}/{len(paths)}")
+    clip.catalogue.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add images to the search catalogue")
+    parser.add_argument("images", help="directory of images (searched recursively)")
+    parser.add_argument("--label", default=None, help="label for every image")
+    parser.add_argument("--label-from-dir", action="store_true", help="use the parent directory name as label")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--api-url", default=None, help="ingest into a running API instead of app/data")
+    parser.add_argument("--admin-token", default=os.environ.get("CATALOGUE_ADMIN_TOKEN"))
+    parser.add_argument("--snapshot", action="store_true", help="with --api-url, persist the catalogue afterwards")
+    args = parser.parse_args()
+    if not args.label and not args.label_from_dir:
+        parser.error("--label or --label-from-dir is required")
+
+    paths = list_images(args.images)
+    start = time.perf_counter()
+    if args.api_url:
+        ingest_api(paths, args)
+    else:
+        ingest_offline(paths, args)
+    elapsed = time.perf_counter() - start
+    print(f"[INGEST] {len(paths)} images in {elapsed:.1f}s ({len(paths) / elapsed:.1f} img/s)")
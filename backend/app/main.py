@@ -3,21 +3,17 @@ warnings.filterwarnings("ignore", message=".*meta parameter.*")
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse
 import os
-import torch
 
-DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
-print(f"[MAIN] Using device: {DEVICE}")
-
-from app.api import cross_modal, multi_label, segmentation, object_detection
+from app.api import cross_modal, multi_label, segmentation, object_detection, analyze, shop_the_look, monitoring, catalogue, health
 from app.models.fashion_clip import FashionClipSingleton
-from app.models.schp import SCHPSingleton
-from app.models.object_detection import FashionObjectDetector
+from app.models.registry import MODEL_DEVICE, MODEL_LOADING, model_registry
+from app.utils.credits import close_credit_client
+from app.utils.process import prefork_worker
+from app.utils import metrics
 
-# Pré-instanciation des singletons avec le bon device
-fashion_clip_singleton = FashionClipSingleton.get_instance(DEVICE)
-schp_singleton = SCHPSingleton.get_instance(DEVICE)
-object_detection_singleton = FashionObjectDetector.get_instance(DEVICE)
+print(f"[MAIN] Using device: {MODEL_DEVICE} (models: {', '.join(model_registry.enabled) or 'none'}, loading: {MODEL_LOADING})")
 
 app = FastAPI(title="Fashion Vision API")
 
@@ -27,64 +23,45 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+if metrics.METRICS_ENABLED:
+    # Request latency / in-flight metrics and the Server-Timing header (outermost, so CORS is timed too)
+    app.add_middleware(metrics.MetricsMiddleware)
 
-# Serve static files (images, etc.)
-static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
-
-# Patch les routers pour utiliser les singletons déjà instanciés
-from fastapi import Depends, UploadFile, File, Form
-from app.schemas.cross_modal import SearchResponse
-from app.schemas.multi_label import MultiLabelResponse
-from app.schemas.segmentation import SegmentationResponse
-from app.schemas.object_detection import ObjectDetectionResponse, DetectedObject
-from app.utils.credits import check_and_decrement_credit
+    @app.get("/metrics", include_in_schema=False)
+    def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-@cross_modal.router.post("/", response_model=SearchResponse)
-async def cross_modal_search(
-    image: UploadFile = File(None),
-    text: str = Form(None),
-    alpha: float = Form(0.5),
-    top_k: int = Form(6),
-    user_id: str = Depends(check_and_decrement_credit)
-):
-    results = fashion_clip_singleton.search(image, text, alpha, top_k)
-    return {"results": results}
+@app.on_event("startup")
+def load_models():
+    # Models load concurrently in background threads; /health/ready reports when they are all up
+    if MODEL_LOADING == "eager":
+        model_registry.load_all()
 
-@multi_label.router.post("/", response_model=MultiLabelResponse)
-async def multi_label_classification(
-    image: UploadFile = File(...),
-    labels: str = Form(...),
-    user_id: str = Depends(check_and_decrement_credit)
-):
-    label_list = [l.strip() for l in labels.split(",") if l.strip()]
-    results = fashion_clip_singleton.multi_label(image, label_list)
-    return {"results": results}
+@app.on_event("shutdown")
+async def shutdown_credits():
+    # Refund unused credit leases and close the pooled Supabase connections
+    await close_credit_client()
 
-@segmentation.router.post("/", response_model=SegmentationResponse)
-async def segment_image(
-    image: UploadFile = File(...),
-    user_id: str = Depends(check_and_decrement_credit)
-):
-    result = schp_singleton.segment(image)
-    return result
+@app.on_event("shutdown")
+def save_label_embeddings():
+    # Pre-fork workers each hold a copy of the cache: worker 0 is the only one that writes it
+    if prefork_worker() not in (None, 0):
+        return
+    if FashionClipSingleton._instance is not None:
+        FashionClipSingleton._instance.save_label_cache()
 
-@object_detection.router.post("/", response_model=ObjectDetectionResponse)
-async def detect_fashion_objects(
-    image: UploadFile = File(...),
-    user_id: str = Depends(check_and_decrement_credit)
-):
-    import io
-    from PIL import Image
-    contents = await image.read()
-    pil_image = Image.open(io.BytesIO(contents)).convert("RGB")
-    detected = object_detection_singleton.detect(pil_image)
-    return ObjectDetectionResponse(
-        detected_objects=[DetectedObject(**obj) for obj in detected]
-    )
+# Serve static files (images, etc.)
+static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "data"))
+app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 app.include_router(cross_modal.router, prefix="/api/v1/search", tags=["Cross-modal Search"])
 app.include_router(multi_label.router, prefix="/api/v1/classify", tags=["Multi-label Classification"])
 app.include_router(segmentation.router, prefix="/api/v1/segment", tags=["Segmentation"])
 app.include_router(object_detection.router, prefix="/api/v1/detect", tags=["Object Detection"])
+app.include_router(analyze.router, prefix="/api/v1/analyze", tags=["Multi-task Analysis"])
+app.include_router(shop_the_look.router, prefix="/api/v1/shop-the-look", tags=["Shop the Look"])
+app.include_router(catalogue.router, prefix="/api/v1/catalogue", tags=["Catalogue"])
+app.include_router(monitoring.router, prefix="/api/v1/monitoring", tags=["Monitoring"])
+app.include_router(health.router, prefix="/health", tags=["Health"])
@@ -0,0 +1,308 @@
+import os
+import hashlib
+import threading
+import numpy as np
+import faiss
+from app.utils.faiss_utils import load_faiss_index, save_faiss_index, load_index_params, make_search_params, supports_add_with_ids
+from app.utils.metadata_store import MetadataStore, open_metadata
+from app.utils.neighbours import NEIGHBOURS_FILE, NeighbourTable
+
+# Items added since the last compaction are merged into the main index past this size
+CATALOGUE_COMPACT_THRESHOLD = int(os.environ.get("CATALOGUE_COMPACT_THRESHOLD", "50000"))
+# Memory-map embeddings and index so that workers share pages through the OS page cache
+CATALOGUE_MMAP = os.environ.get("CATALOGUE_MMAP", "1") == "1"
+# Label-filtered searches over at most this many items are scored exactly instead of through the index
+CATALOGUE_FILTER_EXACT_MAX = int(os.environ.get("CATALOGUE_FILTER_EXACT_MAX", "20000"))
+
+
+class CatalogueSnapshot:
+    """Immutable, searchable state of the catalogue.
+
+    `base` is the main FAISS index, where position == catalogue id. Items added
+    since the last compaction live in the small `delta` index (explicit ids).
+    Deleted ids are tombstoned and excluded at search time with an IDSelector.
+    `embeddings` holds the vectors of every id, in id order, as a tuple of
+    blocks (the mapped embeddings.npy followed by the batches added since).
+    Writers build a new snapshot and swap it in, so a request keeps a
+    consistent view without ever taking a lock.
+    """
+
+    def __init__(self, base, delta, delta_vectors, metadonnees, deleted=frozenset(), version=0, embeddings=()):
+        self.base = base
+        self.delta = delta
+        self.delta_vectors = delta_vectors
+        self.metadonnees = metadonnees  # MetadataStore indexed by id, None for deleted items
+        self.deleted = frozenset(deleted)
+        self.version = version
+        self.embeddings = tuple(embeddings)
+        self.selector = None
+        if self.deleted:
+            self._deleted_ids = np.fromiter(self.deleted, dtype=np.int64)
+            self._deleted_batch = faiss.IDSelectorBatch(len(self._deleted_ids), faiss.swig_ptr(self._deleted_ids))
+            self.selector = faiss.IDSelectorNot(self._deleted_batch)
+
+    @property
+    def next_id(self):
+        return len(self.metadonnees)
+
+    @property
+    def size(self):
+        return len(self.metadonnees) - len(self.deleted)
+
+    def label_ids(self, labels):
+        """Sorted ids of the live items whose label is one of `labels`."""
+        label_index = self.metadonnees.label_index()
+        parts = [label_index[label] for label in labels if label in label_index]
+        ids = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+        if self.deleted:
+            ids = ids[~np.isin(ids, self._deleted_ids)]
+        return ids
+
+    def vectors(self, ids):
+        """Embeddings of sorted `ids`, gathered from the id-ordered blocks."""
+        out = np.empty((len(ids), self.base.d), dtype="float32")
+        start = 0
+        for block in self.embeddings:
+            lo, hi = np.searchsorted(ids, [start, start + len(block)])
+            if hi > lo:
+                out[lo:hi] = block[ids[lo:hi] - start]
+            start += len(block)
+        return out
+
+    def search(self, vectors, top_k, nprobe=None, ef_search=None, labels=None):
+        """Top-k search; with `labels`, only items carrying one of those labels are returned."""
+        x = np.ascontiguousarray(vectors, dtype="float32").reshape(-1, self.base.d)
+        if labels is not None:
+            return self._search_filtered(x, top_k, self.label_ids(labels), nprobe, ef_search)
+        return self._search_index(x, top_k, self.selector, nprobe, ef_search)
+
+    def _search_filtered(self, x, top_k, ids, nprobe=None, ef_search=None):
+        # Vectors are available for every id unless embeddings.npy and the metadata disagree
+        exact = sum(len(block) for block in self.embeddings) == self.next_id
+        if exact and len(ids) <= CATALOGUE_FILTER_EXACT_MAX:
+            return self._search_exact(x, top_k, ids)
+        # Deleted ids are already excluded from `ids`, so one IDSelectorBatch covers both filters
+        selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        D, I = self._search_index(x, top_k, selector, nprobe, ef_search)
+        # IVF/HNSW can miss matches of a rare label in the visited lists/graph: rescore those rows exactly
+        short = (I >= 0).sum(axis=1) < min(top_k, len(ids))
+        if exact and short.any():
+            D[short], I[short] = self._search_exact(x[short], top_k, ids)
+        return D, I
+
+    def _search_exact(self, x, top_k, ids):
+        D = np.full((len(x), top_k), -np.inf, dtype="float32")
+        I = np.full((len(x), top_k), -1, dtype=np.int64)
+        k = min(top_k, len(ids))
+        if k == 0:
+            return D, I
+        scores = x @ self.vectors(ids).T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        D[:, :k] = np.take_along_axis(top_scores, order, axis=1)
+        I[:, :k] = ids[np.take_along_axis(top, order, axis=1)]
+        return D, I
+
+    def _search_index(self, x, top_k, selector, nprobe=None, ef_search=None):
+        params = make_search_params(self.base, nprobe=nprobe, ef_search=ef_search, sel=selector)
+        D, I = self.base.search(x, top_k, params=params) if params is not None else self.base.search(x, top_k)
+        if self.delta.ntotal:
+            delta_params = faiss.SearchParameters(sel=selector) if selector is not None else None
+            Dd, Id = self.delta.search(x, top_k, params=delta_params) if delta_params else self.delta.search(x, top_k)
+            # Merge both result lists by inner product (higher is better)
+            D, I = np.hstack([D, Dd]), np.hstack([I, Id])
+            D = np.where(I < 0, -np.inf, D)
+            order = np.argsort(-D, axis=1, kind="stable")[:, :top_k]
+            D, I = np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+        return D, I
+
+    def format_results(self, indices, scores):
+        results = []
+        for idx, score in zip(indices, scores):
+            if idx < 0:
+                continue
+            item = self.metadonnees[idx]
+            if item is None:
+                continue
+            results.append({
+                "label": item["label"],
+                "image_path": item["path"],
+                "score": float(score)
+            })
+        return results
+
+
+def _empty_delta(d):
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(d))
+
+
+def _load_index(path):
+    if CATALOGUE_MMAP:
+        # IO_FLAG_MMAP_IFC (faiss >= 1.8) also maps flat/HNSW storage, older versions only map IVF lists
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return load_faiss_index(path, flags)
+        except RuntimeError as e:
+            print(f"[WARN] Could not memory-map {path} ({e}), reading it into memory")
+    return load_faiss_index(path)
+
+
+class Catalogue:
+    """Live catalogue: embeddings, FAISS index and metadata with lock-free reads.
+
+    `add` and `delete` publish a new snapshot; `save` compacts and writes
+    embeddings.npy, metadonnees.bin and the index back atomically.
+    Embeddings, index and metadata are memory-mapped rather than loaded.
+    """
+
+    def __init__(self, data_dir):
+        self.neighbours_path = os.path.join(data_dir, NEIGHBOURS_FILE)
+        self._neighbours = None
+        self.embeddings_path = os.path.join(data_dir, "embeddings.npy")
+        self.index_path = os.path.join(data_dir, "faiss_index.index")
+        self.metadata_path = os.path.join(data_dir, "metadonnees.bin")
+        self.embeddings = np.load(self.embeddings_path, mmap_mode="r" if CATALOGUE_MMAP else None)
+        base = _load_index(self.index_path)
+        metadonnees = open_metadata(data_dir)
+        deleted = set(metadonnees.deleted_ids())
+        self._snapshot = CatalogueSnapshot(base, _empty_delta(base.d), np.zeros((0, base.d), dtype="float32"),
+                                           metadonnees, deleted, embeddings=(self.embeddings,))
+        self._appended = []  # vectors added since the last save, in id order
+        self._write_lock = threading.Lock()
+        self._generation = self._files_generation()
+        self._saved_version = 0
+        self._session = os.urandom(6).hex()
+
+    def _files_generation(self):
+        # Size and mtime of the files searches read: changes with every save, index rebuild or conversion
+        h = hashlib.sha256()
+        for path in (self.embeddings_path, self.index_path, self.metadata_path):
+            st = os.stat(path)
+            h.update(f"{st.st_size}:{st.st_mtime_ns};".encode())
+        return h.hexdigest()[:16]
+
+    def cache_tag(self) -> str:
+        """Identifies what searches see, for result-cache keys.
+
+        The saved catalogue is tagged by its files, so cached results survive restarts; unsaved
+        changes get a tag unique to this process, as snapshot versions restart at 0 on reload.
+        """
+        version = self._snapshot.version
+        if version == self._saved_version:
+            return self._generation
+        return f"{self._generation}-{self._session}-v{version}"
+
+    @property
+    def snapshot(self) -> CatalogueSnapshot:
+        return self._snapshot
+
+    @property
+    def neighbours(self):
+        """Precomputed neighbour table, reopened when the offline job rewrites it; None if never built."""
+        try:
+            mtime = os.path.getmtime(self.neighbours_path)
+        except OSError:
+            return None
+        if self._neighbours is None or self._neighbours.mtime != mtime:
+            self._neighbours = NeighbourTable(self.neighbours_path)
+        return self._neighbours
+
+    def current_neighbours(self):
+        """Neighbour table if it was built from what searches see now; None if stale or never built."""
+        table = self.neighbours
+        if table is None or not table.matches(self.cache_tag()):
+            return None
+        return table
+
+    def add(self, vectors, items):
+        """Appends L2-normalized vectors with their metadata; returns the new ids."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if len(vectors) != len(items):
+            raise ValueError("vectors and items must have the same length")
+        with self._write_lock:
+            snap = self._snapshot
+            ids = np.arange(snap.next_id, snap.next_id + len(items), dtype=np.int64)
+            delta = faiss.clone_index(snap.delta)
+            delta.add_with_ids(vectors, ids)
+            self._snapshot = CatalogueSnapshot(
+                snap.base, delta, np.vstack([snap.delta_vectors, vectors]),
+                snap.metadonnees + list(items), snap.deleted, snap.version + 1, snap.embeddings + (vectors,))
+            self._appended.append(vectors)
+        if self._snapshot.delta.ntotal >= CATALOGUE_COMPACT_THRESHOLD:
+            self.compact()
+        return ids.tolist()
+
+    def delete(self, ids):
+        """Tombstones ids; returns the ids that were actually removed."""
+        with self._write_lock:
+            snap = self._snapshot
+            removed = sorted({int(i) for i in ids
+                              if 0 <= int(i) < snap.next_id and int(i) not in snap.deleted
+                              and snap.metadonnees[int(i)] is not None})
+            if removed:
+                self._snapshot = CatalogueSnapshot(snap.base, snap.delta, snap.delta_vectors, snap.metadonnees,
+                                                   snap.deleted | set(removed), snap.version + 1, snap.embeddings)
+        return removed
+
+    def compact(self):
+        """Merges the delta index into a copy of the main index and swaps it in."""
+        with self._write_lock:
+            self._compact_locked()
+
+    def _compact_locked(self):
+        snap = self._snapshot
+        if snap.delta.ntotal == 0:
+            return
+        # A round trip through bytes gives an owned copy: clones of a memory-mapped index still
+        # reference the read-only mapping and cannot grow
+        base = faiss.deserialize_index(faiss.serialize_index(snap.base))
+        first_id = snap.next_id - snap.delta.ntotal
+        if supports_add_with_ids(base):
+            base.add_with_ids(snap.delta_vectors, np.arange(first_id, snap.next_id, dtype=np.int64))
+        else:
+            # Sequential indexes: position == id as long as rows are never physically removed
+            assert base.ntotal == first_id
+            base.add(snap.delta_vectors)
+        # Vectors added one batch at a time are merged into a single block as well
+        embeddings = snap.embeddings[:1] + ((np.vstack(snap.embeddings[1:]),) if len(snap.embeddings) > 1 else ())
+        self._snapshot = CatalogueSnapshot(base, _empty_delta(base.d), np.zeros((0, base.d), dtype="float32"),
+                                           snap.metadonnees, snap.deleted, snap.version + 1, embeddings)
+
+    def save(self):
+        """Compacts, then writes embeddings, metadata and index (each file replaced atomically)."""
+        # One critical section: an add() between the compaction and the writes would reach the
+        # embeddings and metadata files but not the saved index
+        with self._write_lock:
+            self._compact_locked()
+            snap = self._snapshot
+            if self._appended:
+                embeddings = np.vstack([self.embeddings] + self._appended)
+                self._appended = []
+                with open(self.embeddings_path + ".tmp", "wb") as f:
+                    np.save(f, embeddings)
+                os.replace(self.embeddings_path + ".tmp", self.embeddings_path)
+                self.embeddings = np.load(self.embeddings_path, mmap_mode="r") if CATALOGUE_MMAP else embeddings
+            MetadataStore.write(self.metadata_path,
+                                (None if i in snap.deleted else item for i, item in enumerate(snap.metadonnees)))
+            save_faiss_index(snap.base, self.index_path, load_index_params(self.index_path) or None)
+            self._generation = self._files_generation()
+            self._saved_version = snap.version
+            # Readers keep the old mapping of the replaced file; new snapshots use the new one
+            self._snapshot = CatalogueSnapshot(snap.base, snap.delta, snap.delta_vectors,
+                                               MetadataStore(self.metadata_path), snap.deleted, snap.version,
+                                               (self.embeddings,))
+        return snap.version
+
+    def stats(self) -> dict:
+        snap = self._snapshot
+        return {
+            "version": snap.version,
+            "generation": self._generation,
+            "items": snap.size,
+            "next_id": snap.next_id,
+            "deleted": len(snap.deleted),
+            "pending_compaction": int(snap.delta.ntotal),
+            "neighbours": self.neighbours.info if self.neighbours is not None else None,
+            "neighbours_current": self.current_neighbours() is not None,
+        }
@@ -1,22 +1,47 @@
 import os
 import json
+import time
 import numpy as np
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel, pipeline
+from transformers import CLIPProcessor, CLIPModel
 import faiss
 import torch
+from typing import Union
 from fastapi import UploadFile
+from app.utils.batching import MicroBatcher
+from app.utils.executor import get_executor
+from app.utils.embedding_cache import TextEmbeddingCache
+from app.utils.process import rss_mb
+from app.utils.metrics import stage
+from app.utils.image import DecodedImage, load_image, processor_min_side
+from app.utils.faiss_utils import index_info
+from app.models.catalogue import Catalogue
+from app.models.registry import model_registry
+
+# Micro-batching of CLIP encodes (set CLIP_BATCHING=0 to encode each request on its own)
+CLIP_BATCHING = os.environ.get("CLIP_BATCHING", "1") == "1"
+CLIP_BATCH_MAX_SIZE = int(os.environ.get("CLIP_BATCH_MAX_SIZE", "32"))
+CLIP_BATCH_MAX_WAIT_MS = float(os.environ.get("CLIP_BATCH_MAX_WAIT_MS", "5"))
+
+# Same prompt as the transformers zero-shot-image-classification pipeline
+ZERO_SHOT_TEMPLATE = "This is a photo of {}."
+# Label-embedding cache for multi-label classification
+CLIP_LABEL_CACHE_SIZE = int(os.environ.get("CLIP_LABEL_CACHE_SIZE", "50000"))
+CLIP_LABEL_VOCAB = os.environ.get("CLIP_LABEL_VOCAB")  # one label per line, encoded at startup
+CLIP_LABEL_CACHE_FILE = os.environ.get("CLIP_LABEL_CACHE_FILE")  # .npz persisted across restarts
 
 class FashionClipSingleton:
     _instance = None
 
     @classmethod
     def get_instance(cls, device=None):
+        # Loaded once (thread-safe) by the model registry, which applies MODEL_LOADING / MODELS_ENABLED
         if cls._instance is None:
-            cls._instance = cls(device)
+            return model_registry.get("clip", device)
         return cls._instance
 
     def __init__(self, device=None):
+        start = time.perf_counter()
         # --- Load model and processor ---
         self.model_name = "patrickjohncyh/fashion-clip"
         self.processor = CLIPProcessor.from_pretrained(self.model_name)
@@ -28,93 +53,261 @@ class FashionClipSingleton:
             self.device = torch.device(device)
         print(f"[INFO] FashionCLIP device: {self.device}")
         self.model.to(self.device)
+        # Uploads are decoded just large enough for the vision tower's resize
+        self.image_min_side = processor_min_side(self.processor.image_processor, 224)
+        self.text_stream = torch.cuda.Stream(device=self.device) if self.device.type == "cuda" else None
 
-        # --- Load embeddings, index, metadata ---
+        # --- Load embeddings, index, metadata (live catalogue, snapshot per request) ---
         data_dir = os.path.join(os.path.dirname(__file__), "../data")
-        self.embeddings = np.load(os.path.join(data_dir, "embeddings.npy"))
-        self.index = faiss.read_index(os.path.join(data_dir, "faiss_index.index"))
-        with open(os.path.join(data_dir, "metadonnees.json"), "r") as f:
-            self.metadonnees = json.load(f)
+        self.catalogue = Catalogue(data_dir)
+        print(f"[INFO] FAISS index: {index_info(self.catalogue.snapshot.base)}")
 
-        # --- Zero-shot pipeline for multi-label ---
-        # device=0 pour GPU, -1 pour CPU
-        pipe_device = 0 if self.device.type == "cuda" else -1
-        self.zero_shot_pipe = pipeline("zero-shot-image-classification", model=self.model_name, device=pipe_device)
+        # --- Request-coalescing schedulers in front of the two towers ---
+        self.image_batcher = None
+        self.text_batcher = None
+        if CLIP_BATCHING:
+            # Requests encode from the CLIP pool: a batch is sent as soon as every running call has queued
+            # its item, so realized batches are at most CLIP_CONCURRENCY items and a lone request never waits
+            pool = get_executor("clip")
+            self.image_batcher = MicroBatcher(
+                "clip-image", self._encode_images_split, CLIP_BATCH_MAX_SIZE, CLIP_BATCH_MAX_WAIT_MS,
+                active_callers=pool.running)
+            self.text_batcher = MicroBatcher(
+                "clip-text", self._encode_texts_split, CLIP_BATCH_MAX_SIZE, CLIP_BATCH_MAX_WAIT_MS,
+                active_callers=pool.running)
 
-    def _encode_image(self, image: Image.Image):
-        inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-        with torch.no_grad():
+        # --- Cached label embeddings for zero-shot classification ---
+        self.label_cache = TextEmbeddingCache(self._encode_labels, max_entries=CLIP_LABEL_CACHE_SIZE, device=self.device)
+        if CLIP_LABEL_CACHE_FILE:
+            print(f"[INFO] Loaded {self.label_cache.load(CLIP_LABEL_CACHE_FILE)} cached label embeddings")
+        if CLIP_LABEL_VOCAB:
+            print(f"[INFO] Encoded {self.label_cache.preload_vocabulary(CLIP_LABEL_VOCAB)} labels from {CLIP_LABEL_VOCAB}")
+        print(f"[INFO] FashionCLIP loaded in {time.perf_counter() - start:.1f}s (RSS {rss_mb():.0f} MB)")
+
+    def warmup(self):
+        # One pass through both towers and the index (allocations, kernel selection, index pages)
+        features = self._encode_images([Image.new("RGB", (self.image_min_side, self.image_min_side))])
+        self._encode_texts(["warm-up"])
+        self._search_vectors(features.cpu().numpy().astype("float32"), 1)
+
+    def decode_image(self, image) -> Image.Image:
+        return load_image(image, min_side=self.image_min_side).image
+
+    def _encode_images(self, images):
+        with stage("clip_image_preprocess"):
+            inputs = self.processor(images=images, return_tensors="pt").to(self.device)
+        with torch.no_grad(), stage("clip_image_forward"):
             features = self.model.get_image_features(**inputs)
             features = features / features.norm(p=2, dim=-1, keepdim=True)
         return features
 
-    def _encode_text(self, text: str):
-        inputs = self.processor(text=[text], return_tensors="pt").to(self.device)
-        with torch.no_grad():
+    def _encode_texts(self, texts):
+        inputs = self.processor(text=list(texts), return_tensors="pt", padding=True, truncation=True).to(self.device)
+        with torch.no_grad(), stage("clip_text_forward"):
             features = self.model.get_text_features(**inputs)
             features = features / features.norm(p=2, dim=-1, keepdim=True)
         return features
 
-    def search(self, image: UploadFile = None, text: str = None, alpha: float = 0.5, top_k: int = 6):
-        # Dispatch to the right search method
+    def _encode_labels(self, labels):
+        return self._encode_texts([ZERO_SHOT_TEMPLATE.format(label) for label in labels])
+
+    def _encode_images_split(self, images):
+        features = self._encode_images(images)
+        return [features[i:i + 1] for i in range(features.shape[0])]
+
+    def _encode_texts_split(self, texts):
+        features = self._encode_texts(texts)
+        return [features[i:i + 1] for i in range(features.shape[0])]
+
+    def _encode_image(self, image: Image.Image):
+        if self.image_batcher is not None:
+            return self.image_batcher(image)
+        return self._encode_images([image])
+
+    def _encode_text(self, text: str):
+        if self.text_batcher is not None:
+            return self.text_batcher(text)
+        return self._encode_texts([text])
+
+    def _encode_pair(self, image: Image.Image, text: str):
+        # One processor call and one host->device copy for both towers
+        with stage("clip_pair_preprocess"):
+            inputs = self.processor(text=[text], images=image, return_tensors="pt", padding=True, truncation=True).to(self.device)
+        with torch.no_grad(), stage("clip_pair_forward"):
+            if self.text_stream is not None:
+                # Text tower on a side stream, overlapping with the vision tower
+                self.text_stream.wait_stream(torch.cuda.current_stream(self.device))
+                with torch.cuda.stream(self.text_stream):
+                    text_features = self.model.get_text_features(
+                        input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])
+                image_features = self.model.get_image_features(pixel_values=inputs["pixel_values"])
+                torch.cuda.current_stream(self.device).wait_stream(self.text_stream)
+            else:
+                text_features = self.model.get_text_features(
+                    input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])
+                image_features = self.model.get_image_features(pixel_values=inputs["pixel_values"])
+            features = torch.cat([image_features, text_features], dim=0)
+            features = features / features.norm(p=2, dim=-1, keepdim=True)
+            # Single device->host sync
+            features = features.cpu()
+        return features[0:1], features[1:2]
+
+    @property
+    def index(self):
+        return self.catalogue.snapshot.base
+
+    @property
+    def metadonnees(self):
+        return self.catalogue.snapshot.metadonnees
+
+    def _search_vectors(self, vectors, top_k, nprobe=None, ef_search=None, labels=None):
+        # One snapshot for the whole query so a concurrent ingestion swap cannot mix index and metadata
+        snapshot = self.catalogue.snapshot
+        with stage("index_search"):
+            D, I = snapshot.search(vectors, top_k, nprobe=nprobe, ef_search=ef_search, labels=labels)
+        with stage("format_results"):
+            return [snapshot.format_results(I[row], D[row]) for row in range(len(I))]
+
+    def batching_stats(self):
+        return [b.stats() for b in (self.image_batcher, self.text_batcher) if b is not None]
+
+    def search(self, image: Union[UploadFile, bytes, DecodedImage] = None, text: str = None, alpha: float = 0.5, top_k: int = 6,
+               nprobe: int = None, ef_search: int = None, labels=None):
+        # Dispatch to the right search method; `labels` restricts results to those catalogue labels
+        knobs = {"nprobe": nprobe, "ef_search": ef_search, "labels": labels}
         if image and text:
-            return self.search_combined(image, text, alpha, top_k)
+            return self.search_combined(image, text, alpha, top_k, **knobs)
         elif image and not text:
-            return self.search_by_image(image, top_k)
+            return self.search_by_image(image, top_k, **knobs)
         elif text and not image:
-            return self.search_by_text(text, top_k)
+            return self.search_by_text(text, top_k, **knobs)
         else:
             return []
 
-    def search_by_text(self, text: str, top_k: int = 6):
+    def search_by_text(self, text: str, top_k: int = 6, nprobe: int = None, ef_search: int = None, labels=None):
         text_features = self._encode_text(text)
         vec = text_features[0].cpu().numpy().astype("float32").reshape(1, -1)
-        D, I = self.index.search(vec, top_k)
-        results = []
-        for idx, score in zip(I[0], D[0]):
-            item = self.metadonnees[idx]
-            results.append({
-                "label": item["label"],
-                "image_path": item["path"],
-                "score": float(score)
-            })
-        return results
-
-    def search_by_image(self, image: UploadFile, top_k: int = 6):
-        img = Image.open(image.file).convert("RGB")
-        image_features = self._encode_image(img)
-        vec = image_features[0].cpu().numpy().astype("float32").reshape(1, -1)
-        D, I = self.index.search(vec, top_k)
-        results = []
-        for idx, score in zip(I[0], D[0]):
-            item = self.metadonnees[idx]
-            results.append({
-                "label": item["label"],
-                "image_path": item["path"],
-                "score": float(score)
-            })
-        return results
-
-    def search_combined(self, image: UploadFile, text: str, alpha: float = 0.5, top_k: int = 6):
-        img = Image.open(image.file).convert("RGB")
-        image_features = self._encode_image(img)
-        text_features = self._encode_text(text)
-        combined = alpha * text_features + (1 - alpha) * image_features
+        return self._search_vectors(vec, top_k, nprobe=nprobe, ef_search=ef_search, labels=labels)[0]
+
+    def image_embedding(self, image: Union[UploadFile, bytes, DecodedImage]):
+        """Normalized (1, D) image embedding, shared by search and classification."""
+        return self._encode_image(self.decode_image(image))
+
+    def search_by_embedding(self, features, top_k: int = 6, nprobe: int = None, ef_search: int = None, labels=None):
+        vec = features[0].cpu().numpy().astype("float32").reshape(1, -1)
+        return self._search_vectors(vec, top_k, nprobe=nprobe, ef_search=ef_search, labels=labels)[0]
+
+    def search_by_image(self, image: Union[UploadFile, bytes, DecodedImage], top_k: int = 6, nprobe: int = None,
+                        ef_search: int = None, labels=None):
+        return self.search_by_embedding(self.image_embedding(image), top_k, nprobe=nprobe, ef_search=ef_search,
+                                        labels=labels)
+
+    def search_combined(self, image: Union[UploadFile, bytes, DecodedImage], text: str, alpha: float = 0.5, top_k: int = 6,
+                        nprobe: int = None, ef_search: int = None, labels=None):
+        return self.search_combined_alphas(image, text, [alpha], top_k, nprobe=nprobe, ef_search=ef_search,
+                                           labels=labels)[0]
+
+    def search_combined_alphas(self, image: Union[UploadFile, bytes, DecodedImage], text: str, alphas,
+                               top_k: int = 6, nprobe: int = None, ef_search: int = None, labels=None):
+        # Both embeddings are computed once and reused for every alpha; one index search for all of them
+        img = self.decode_image(image)
+        image_features, text_features = self._encode_pair(img, text)
+        weights = torch.tensor(alphas, dtype=image_features.dtype).unsqueeze(1)
+        combined = weights * text_features + (1 - weights) * image_features
         combined = combined / combined.norm(p=2, dim=-1, keepdim=True)
-        vec = combined[0].cpu().numpy().astype("float32").reshape(1, -1)
-        D, I = self.index.search(vec, top_k)
-        results = []
-        for idx, score in zip(I[0], D[0]):
-            item = self.metadonnees[idx]
-            results.append({
-                "label": item["label"],
-                "image_path": item["path"],
-                "score": float(score)
-            })
-        return results
-
-    def multi_label(self, image: UploadFile, label_list):
-        img = Image.open(image.file).convert("RGB")
-        results = self.zero_shot_pipe(img, candidate_labels=label_list)
+        return self._search_vectors(combined.numpy(), top_k, nprobe=nprobe, ef_search=ef_search, labels=labels)
+
+    def similar_items(self, item_id: int = None, image_path: str = None, top_k: int = 6):
+        """Neighbours of a catalogue item, by id or image path; no model call.
+
+        Read from the precomputed neighbour table when it matches the live catalogue, otherwise
+        (table stale or never built) searched in the index with the item's stored embedding.
+        Returns None when the item is unknown.
+        """
+        table = self.catalogue.current_neighbours()
+        snapshot = self.catalogue.snapshot
+        if item_id is None and image_path is not None:
+            item_id = snapshot.metadonnees.find_path(image_path)
+        if item_id is None or not 0 <= item_id < snapshot.next_id or item_id in snapshot.deleted \
+                or snapshot.metadonnees[item_id] is None:
+            return None
+        found = table.lookup(item_id) if table is not None else None
+        if found is None:
+            # Vectors exist for every id unless embeddings.npy and the metadata disagree
+            if item_id >= sum(len(block) for block in snapshot.embeddings):
+                return None
+            with stage("index_search"):
+                D, I = snapshot.search(snapshot.vectors(np.array([item_id])), top_k + 1)
+            keep = I[0] != item_id
+            return snapshot.format_results(I[0][keep][:top_k], D[0][keep][:top_k])
+        ids, scores = found
+        # Items deleted since the table was built are skipped by format_results
+        keep = ~np.isin(ids, list(snapshot.deleted)) if snapshot.deleted else slice(None)
+        return snapshot.format_results(ids[keep][:top_k], scores[keep][:top_k])
+
+    def search_batch(self, texts=(), images=(), top_k: int = 6, batch_size: int = 64,
+                     nprobe: int = None, ef_search: int = None, labels=None):
+        """Searches many queries at once: texts then images (PIL), in that order.
+
+        Queries are encoded `batch_size` at a time and the stacked matrix goes
+        through a single index search. Returns one result list per query.
+        """
+        features = []
+        for start in range(0, len(texts), batch_size):
+            features.append(self._encode_texts(texts[start:start + batch_size]).cpu())
+        for start in range(0, len(images), batch_size):
+            features.append(self._encode_images(images[start:start + batch_size]).cpu())
+        if not features:
+            return []
+        vectors = torch.cat(features).numpy().astype("float32")
+        return self._search_vectors(vectors, top_k, nprobe=nprobe, ef_search=ef_search, labels=labels)
+
+    def multi_label(self, image: Union[UploadFile, bytes, DecodedImage], label_list):
+        # Zero-shot classification on the already-loaded model (no second copy of the weights)
+        if not label_list:
+            return []
+        return self.classify_embedding(self.image_embedding(image), label_list)
+
+    def classify_embedding(self, image_features, label_list):
+        # One matrix product against the cached label matrix
+        label_matrix = self.label_cache.matrix(label_list)
+        with torch.no_grad(), stage("classify"):
+            logits = self.model.logit_scale.exp() * image_features @ label_matrix.T
+            probs = logits.softmax(dim=-1)[0].cpu().tolist()
+        results = sorted(zip(probs, label_list), key=lambda x: -x[0])
         # Format: [{"label": ..., "score": ...}, ...]
-        return [{"label": r["label"], "score": float(r["score"])} for r in results]
+        return [{"label": label, "score": float(score)} for score, label in results]
+
+    def analyze(self, image: Union[UploadFile, bytes, DecodedImage], top_k: int = 6, classify_labels=None,
+                search: bool = True, nprobe: int = None, ef_search: int = None, labels=None):
+        """Search and/or zero-shot classification from a single image embedding.
+
+        Returns `(results, timings)`: results has "search" and "classification"
+        entries for the requested tasks, timings the milliseconds of each step.
+        """
+        timings, results = {}, {}
+        start = time.perf_counter()
+        features = self.image_embedding(image)
+        timings["clip_embed"] = (time.perf_counter() - start) * 1000
+        if search:
+            start = time.perf_counter()
+            results["search"] = self.search_by_embedding(features, top_k, nprobe=nprobe, ef_search=ef_search,
+                                                         labels=labels)
+            timings["search"] = (time.perf_counter() - start) * 1000
+        if classify_labels:
+            start = time.perf_counter()
+            results["classification"] = self.classify_embedding(features, classify_labels)
+            timings["classify"] = (time.perf_counter() - start) * 1000
+        return results, timings
+
+    def save_label_cache(self):
+        if CLIP_LABEL_CACHE_FILE:
+            self.label_cache.save(CLIP_LABEL_CACHE_FILE)
+
+    def ingest(self, images, items, batch_size: int = 64):
+        """Embeds images in batches through the image tower and appends them to the live catalogue."""
+        ids = []
+        for start in range(0, len(images), batch_size):
+            features = self._encode_images(images[start:start + batch_size])
+            ids.extend(self.catalogue.add(features.cpu().numpy(), items[start:start + batch_size]))
+        return ids
@@ -2,6 +2,9 @@ from PIL import Image
 from transformers import AutoImageProcessor, AutoModelForObjectDetection
 import torch
 from typing import List, Dict, Union
+from app.utils.image import DecodedImage, load_image, processor_min_side
+from app.utils.metrics import stage
+from app.models.registry import model_registry
 
 MODEL_ID = "yainage90/fashion-object-detection"
 
@@ -10,8 +13,9 @@ class FashionObjectDetector:
 
     @classmethod
     def get_instance(cls, device=None):
+        # Loaded once (thread-safe) by the model registry, which applies MODEL_LOADING / MODELS_ENABLED
         if cls._instance is None:
-            cls._instance = cls(device)
+            return model_registry.get("detector", device)
         return cls._instance
 
     def __init__(self, device=None):
@@ -23,17 +27,23 @@ class FashionObjectDetector:
             self.device = torch.device(device)
         print(f"[INFO] ObjectDetection device: {self.device}")
         self.model.to(self.device)
+        # Uploads are decoded just large enough for the processor's resize
+        self.image_min_side = processor_min_side(self.processor, 800)
 
-    def detect(self, image: Union[str, Image.Image], threshold: float = 0.3) -> List[Dict]:
-        if isinstance(image, str):
-            image = Image.open(image).convert("RGB")
-        else:
-            image = image.convert("RGB")
-        inputs = self.processor(images=[image], return_tensors="pt").to(self.device)
-        with torch.no_grad():
+    def warmup(self):
+        self.detect(Image.new("RGB", (self.image_min_side, self.image_min_side)))
+
+    def detect(self, image: Union[str, bytes, Image.Image, DecodedImage], threshold: float = 0.3) -> List[Dict]:
+        decoded = load_image(image, min_side=self.image_min_side)
+        with stage("detector_preprocess"):
+            inputs = self.processor(images=[decoded.image], return_tensors="pt").to(self.device)
+        with torch.no_grad(), stage("detector_forward"):
             outputs = self.model(**inputs)
-        target_sizes = torch.tensor([[image.size[1], image.size[0]]]).to(self.device)
-        results = self.processor.post_process_object_detection(outputs, threshold=threshold, target_sizes=target_sizes)[0]
+        # Boxes are predicted in relative coordinates: scale them to the uploaded image, not the decoded one
+        width, height = decoded.original_size
+        target_sizes = torch.tensor([[height, width]]).to(self.device)
+        with stage("detector_postprocess"):
+            results = self.processor.post_process_object_detection(outputs, threshold=threshold, target_sizes=target_sizes)[0]
         detected = []
         for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
             detected.append({
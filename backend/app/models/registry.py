@@ -0,0 +1,201 @@
+# Model loading policy: which models this replica serves, and when they are loaded
+#
+#   MODEL_LOADING=eager   load every enabled model at startup, concurrently, in background threads (default)
+#   MODEL_LOADING=lazy    load a model the first time a request needs it
+#   MODELS_ENABLED=clip   serve a subset (clip, schp, detector); routes of the other models answer 503
+#   MODEL_WARMUP=1        run one dummy inference after loading, so the first real request is not slow
+#
+# The singletons' get_instance() go through `model_registry`. A model that is not loaded yet is loaded
+# in a background thread: callers on a worker thread wait for it, callers on the event loop get a 503
+# (Retry-After) instead of blocking the server while weights load.
+#
+# Routes declare their models with `Depends(model_registry.requires("clip", ...))` before the credit
+# dependency: the 503 of a disabled, failed or still-loading model comes before the request is charged,
+# and in lazy mode the first request awaits the load instead of failing.
+import os
+import time
+import asyncio
+import importlib
+import threading
+import traceback
+from concurrent.futures import Future
+import torch
+from fastapi import Depends, HTTPException
+from app.utils.credits import get_user_id_from_token
+from app.utils.metrics import observe_model_load
+
+MODEL_LOADING = os.environ.get("MODEL_LOADING", "eager")
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "0") == "1"
+MODEL_DEVICE = os.environ.get("MODEL_DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+
+# name -> "module:class" of the singleton (imported on first load)
+MODEL_CLASSES = {
+    "clip": "app.models.fashion_clip:FashionClipSingleton",
+    "schp": "app.models.schp:SCHPSingleton",
+    "detector": "app.models.object_detection:FashionObjectDetector",
+}
+MODELS_ENABLED = [m.strip() for m in os.environ.get("MODELS_ENABLED", ",".join(MODEL_CLASSES)).split(",") if m.strip()]
+
+if MODEL_LOADING not in ("eager", "lazy"):
+    raise ValueError(f"MODEL_LOADING must be 'eager' or 'lazy', got {MODEL_LOADING!r}")
+if set(MODELS_ENABLED) - set(MODEL_CLASSES):
+    raise ValueError(f"Unknown models in MODELS_ENABLED: {', '.join(sorted(set(MODELS_ENABLED) - set(MODEL_CLASSES)))}")
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class _ModelState:
+    def __init__(self, name):
+        self.name = name
+        self.status = "not_loaded"  # not_loaded | loading | warming_up | ready | failed | disabled
+        self.instance = None
+        self.future = None
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+
+class ModelRegistry:
+    """Loads the model singletons once, concurrently, and reports their status."""
+
+    def __init__(self, enabled=MODELS_ENABLED, device=MODEL_DEVICE, warmup=MODEL_WARMUP):
+        self.enabled = list(enabled)
+        self.device = device
+        self.warmup = warmup
+        self._states = {name: _ModelState(name) for name in MODEL_CLASSES}
+        for name, state in self._states.items():
+            if name not in self.enabled:
+                state.status = "disabled"
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def model_class(name):
+        module, cls = MODEL_CLASSES[name].split(":")
+        return getattr(importlib.import_module(module), cls)
+
+    def _load(self, state, device, future):
+        start = time.perf_counter()
+        try:
+            cls = self.model_class(state.name)
+            instance = cls(device or self.device)
+            state.load_seconds = time.perf_counter() - start
+            observe_model_load(state.name, state.load_seconds)
+            if self.warmup:
+                self._warm_up(state, instance)
+            # Published last: get_instance() returns it without locking from now on
+            cls._instance = state.instance = instance
+            state.status = "ready"
+            print(f"[INFO] Model {state.name} ready in {state.load_seconds:.1f}s"
+                  + (f" (+{state.warmup_seconds:.1f}s warm-up)" if state.warmup_seconds else ""))
+            future.set_result(instance)
+        except BaseException as e:
+            state.status, state.error = "failed", f"{type(e).__name__}: {e}"
+            print(f"[ERROR] Loading model {state.name} failed:\n{traceback.format_exc()}")
+            future.set_exception(e)
+
+    @staticmethod
+    def _warm_up(state, instance):
+        if hasattr(instance, "warmup"):
+            state.status = "warming_up"
+            start = time.perf_counter()
+            instance.warmup()
+            state.warmup_seconds = time.perf_counter() - start
+
+    def warm_up_loaded(self):
+        """Warm-up pass of every loaded model (pre-fork workers warm up after the fork, see app/serve.py)."""
+        for state in self._states.values():
+            if state.instance is not None:
+                self._warm_up(state, state.instance)
+                state.status = "ready"
+
+    def load(self, name, device=None) -> Future:
+        """Starts loading `name` in a background thread (once; again after a failure) and returns its future."""
+        state = self._states[name]
+        with self._lock:
+            if state.future is None or state.status == "failed":
+                state.status, state.error = "loading", None
+                state.future = Future()
+                threading.Thread(target=self._load, args=(state, device, state.future),
+                                 name=f"load-{name}", daemon=True).start()
+            return state.future
+
+    def load_all(self, wait=False):
+        """Loads every enabled model concurrently; with `wait`, blocks until all are loaded (raises on failure)."""
+        futures = [self.load(name) for name in self.enabled]
+        if wait:
+            for future in futures:
+                future.result()
+        return futures
+
+    def get(self, name, device=None):
+        state = self._states[name]
+        if state.instance is not None:
+            return state.instance
+        if name not in self.enabled:
+            raise HTTPException(status_code=503, detail=f"Modèle {name} non servi par cette instance")
+        future = self.load(name, device)
+        if _on_event_loop() and not future.done():
+            raise HTTPException(status_code=503, detail=f"Modèle {name} en cours de chargement, réessayez plus tard",
+                                headers={"Retry-After": "5"})
+        try:
+            return future.result()
+        except Exception:
+            raise HTTPException(status_code=503, detail=f"Modèle {name} indisponible : {state.error}")
+
+    async def ensure_loaded(self, *names):
+        """Awaits the models in lazy mode; 503 if one is disabled, failed, or still loading at startup."""
+        for name in names:
+            state = self._states[name]
+            if state.instance is not None:
+                continue
+            if name not in self.enabled:
+                raise HTTPException(status_code=503, detail=f"Modèle {name} non servi par cette instance")
+            future = self.load(name)
+            if MODEL_LOADING == "eager" and not future.done():
+                raise HTTPException(status_code=503, detail=f"Modèle {name} en cours de chargement, réessayez plus tard",
+                                    headers={"Retry-After": "5"})
+            try:
+                await asyncio.wrap_future(future)
+            except Exception:
+                raise HTTPException(status_code=503, detail=f"Modèle {name} indisponible : {state.error}")
+
+    def requires(self, *names, authenticated: bool = True):
+        """Route dependency checking `names` after authentication and before the credit is taken.
+
+        With `authenticated=False` (public and admin-token routes) no bearer token is read.
+        """
+        if not authenticated:
+            async def dependency():
+                await self.ensure_loaded(*names)
+            return dependency
+
+        async def dependency(_user_id: str = Depends(get_user_id_from_token)):
+            await self.ensure_loaded(*names)
+        return dependency
+
+    def is_ready(self) -> bool:
+        # Lazy replicas are ready as long as nothing failed: models load on first use
+        statuses = [self._states[name].status for name in self.enabled]
+        if MODEL_LOADING == "lazy":
+            return "failed" not in statuses
+        return all(status == "ready" for status in statuses)
+
+    def status(self) -> dict:
+        return {
+            name: {
+                "status": state.status,
+                "load_seconds": None if state.load_seconds is None else round(state.load_seconds, 3),
+                "warmup_seconds": None if state.warmup_seconds is None else round(state.warmup_seconds, 3),
+                "error": state.error,
+            }
+            for name, state in self._states.items()
+        }
+
+
+model_registry = ModelRegistry()
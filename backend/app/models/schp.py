@@ -1,12 +1,26 @@
 import os
+import cv2
 import numpy as np
 from PIL import Image
 import torch
 import base64
+from typing import Union
 from fastapi import UploadFile, HTTPException
 from PIL import UnidentifiedImageError
 import sys
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from ..data.SCHP import SCHP
+from app.utils.image import DecodedImage, load_image
+from app.utils.masks import fit_size, label_counts, label_png, polygons, rle_encode
+from app.utils.metrics import stage
+from app.models.registry import model_registry
+
+# Argmax at network resolution then nearest-warp the label map (faster, slightly blockier edges)
+SCHP_ARGMAX_FIRST = os.environ.get("SCHP_ARGMAX_FIRST", "0") == "1"
+
+# Output formats of `segment`: colour PNG (legacy), palettized label-id PNG, COCO RLE, polygons, labels only
+SEGMENT_FORMATS = ("color_png", "color_png_palette", "label_png", "rle", "polygons", "labels")
 
 # Hardcoded color mapping for all labels (HEX)
 LABEL_COLORS = {
@@ -58,13 +72,42 @@ LABEL_PRIORITY = {
     "Hair": 4
 }
 
+
+def _schp_stage(name):
+    # Steps of the vendored SCHP.parse(), reported as schp_preprocess / schp_forward / schp_postprocess
+    return stage(f"schp_{name}")
+
+
+def _hex_to_rgb(hex_color):
+    return tuple(int(hex_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
+
+
+def build_color_lut(mapping):
+    """(256, 3) uint8 colour of each label id; ids missing from `mapping` stay black."""
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    for idx, label in mapping.items():
+        lut[idx] = _hex_to_rgb(LABEL_COLORS.get(label, "#CCCCCC"))
+    return lut
+
+
+# Colour lookup tables, computed once per mapping
+_COLOR_LUTS = {tuple(m.items()): build_color_lut(m) for m in (ATR_MAPPING, LIP_MAPPING)}
+
+
+def color_lut(mapping):
+    key = tuple(mapping.items())
+    if key not in _COLOR_LUTS:
+        _COLOR_LUTS[key] = build_color_lut(mapping)
+    return _COLOR_LUTS[key]
+
 class SCHPSingleton:
     _instance = None
 
     @classmethod
     def get_instance(cls, device=None):
+        # Loaded once (thread-safe) by the model registry, which applies MODEL_LOADING / MODELS_ENABLED
         if cls._instance is None:
-            cls._instance = cls(device)
+            return model_registry.get("schp", device)
         return cls._instance
 
     def __init__(self, device=None):
@@ -77,53 +120,131 @@ class SCHPSingleton:
         ckpt_dir = os.path.join(data_dir, "checkpoints")
         self.schp_atr = SCHP(ckpt_path=os.path.join(ckpt_dir, "exp-schp-201908301523-atr.pth"), device=self.device)
         self.schp_lip = SCHP(ckpt_path=os.path.join(ckpt_dir, "exp-schp-201908261155-lip.pth"), device=self.device)
+        self.parsers = {
+            "atr": (self.schp_atr, ATR_MAPPING),
+            "lip": (self.schp_lip, LIP_MAPPING),
+        }
+        # ATR and LIP run side by side when both are requested (one CUDA stream each on GPU)
+        self.pool = ThreadPoolExecutor(max_workers=len(self.parsers), thread_name_prefix="schp")
+        self.streams = {}
+        if torch.device(self.device).type == "cuda":
+            self.streams = {name: torch.cuda.Stream(device=self.device) for name in self.parsers}
+
+    def warmup(self):
+        img_array = np.zeros((512, 384, 3), dtype=np.uint8)
+        for name in self.parsers:
+            self._run_parser(name, img_array)
+
+    def _run_parser(self, name, img_array):
+        schp, _ = self.parsers[name]
+        stream = self.streams.get(name)
+        if stream is None:
+            return schp.parse([img_array], argmax_first=SCHP_ARGMAX_FIRST, timer=_schp_stage)[0]
+        with torch.cuda.stream(stream):
+            return schp.parse([img_array], argmax_first=SCHP_ARGMAX_FIRST, timer=_schp_stage)[0]
 
-    def segment(self, image: UploadFile):
+    def parse_masks(self, image: Union[UploadFile, bytes, DecodedImage], parsers=("atr", "lip"), max_size: int = None):
+        """Label-id maps (uint8) per parser, at the upload size or fitted in `max_size` pixels."""
+        parsers = list(dict.fromkeys(parsers))
+        unknown = [p for p in parsers if p not in self.parsers]
+        if not parsers or unknown:
+            raise HTTPException(status_code=400, detail=f"Parsers invalides : {', '.join(unknown) or 'aucun'} (attendus : atr, lip)")
         try:
-            img = Image.open(image.file).convert("RGB")
+            decoded = load_image(image)
         except UnidentifiedImageError:
             raise HTTPException(status_code=400, detail="Le fichier uploadé n'est pas une image valide ou est corrompu.")
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Erreur lors de l'ouverture de l'image : {str(e)}")
-        atr_mask = np.array(self.schp_atr([img]))
-        lip_mask = np.array(self.schp_lip([img]))
+        # One decode and one array conversion shared by every parser
+        img_array = decoded.array
+        if len(parsers) == 1:
+            masks = {parsers[0]: self._run_parser(parsers[0], img_array)}
+        else:
+            # Each parser runs in the request's context (its stages reach the request's timings)
+            futures = {name: self.pool.submit(contextvars.copy_context().run, self._run_parser, name, img_array)
+                       for name in parsers}
+            masks = {name: future.result() for name, future in futures.items()}
+        # Masks keep the upload's size (uploads over the pixel budget are parsed downscaled), unless the
+        # client asked for at most `max_size` pixels
+        size = fit_size(decoded.original_size, max_size)
+        if size != decoded.size:
+            masks = {name: cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST) for name, mask in masks.items()}
+        return masks
 
-        atr_labels = sorted(np.unique(atr_mask))
-        lip_labels = sorted(np.unique(lip_mask))
-        atr_detected = [ATR_MAPPING[i] for i in atr_labels if i in ATR_MAPPING]
-        lip_detected = [LIP_MAPPING[i] for i in lip_labels if i in LIP_MAPPING]
+    def segment(self, image: Union[UploadFile, bytes, DecodedImage], parsers=("atr", "lip"),
+                output_format: str = "color_png", max_size: int = None):
+        if output_format not in SEGMENT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Format invalide : {output_format} (attendus : {', '.join(SEGMENT_FORMATS)})")
+        masks = self.parse_masks(image, parsers, max_size=max_size)
 
-        # Générer masques colorés ATR et LIP
-        color_mask_atr_img, color_map_atr = self.generate_color_mask_simple(atr_mask, ATR_MAPPING)
-        color_mask_lip_img, color_map_lip = self.generate_color_mask_simple(lip_mask, LIP_MAPPING)
+        result = {"format": output_format}
         import io
-        buf_atr = io.BytesIO()
-        color_mask_atr_img.save(buf_atr, format='PNG')
-        mask_color_atr_base64 = base64.b64encode(buf_atr.getvalue()).decode('utf-8')
-        buf_lip = io.BytesIO()
-        color_mask_lip_img.save(buf_lip, format='PNG')
-        mask_color_lip_base64 = base64.b64encode(buf_lip.getvalue()).decode('utf-8')
-
-        return {
-            "detected_labels_atr": atr_detected,
-            "detected_labels_lip": lip_detected,
-            "mask_color_atr_base64": mask_color_atr_base64,
-            "mask_color_lip_base64": mask_color_lip_base64,
-            "color_map_atr": color_map_atr,
-            "color_map_lip": color_map_lip
+        for name in ("atr", "lip"):
+            if name not in masks:
+                result[f"detected_labels_{name}"] = None
+                continue
+            mask = masks[name]
+            schp, mapping = self.parsers[name]
+            present = [int(i) for i in np.flatnonzero(label_counts(mask)) if i in mapping]
+            result[f"detected_labels_{name}"] = [mapping[i] for i in present]
+            result["mask_size"] = [mask.shape[1], mask.shape[0]]
+            if output_format in ("color_png", "color_png_palette"):
+                # Générer le masque coloré
+                with stage("schp_colorize"):
+                    color_mask_img, color_map = self.generate_color_mask_simple(
+                        mask, mapping, palette=output_format == "color_png_palette")
+                with stage("mask_encode"):
+                    buf = io.BytesIO()
+                    color_mask_img.save(buf, format='PNG')
+                    result[f"mask_color_{name}_base64"] = base64.b64encode(buf.getvalue()).decode('utf-8')
+                result[f"color_map_{name}"] = color_map
+            elif output_format == "label_png":
+                with stage("mask_encode"):
+                    result[f"mask_label_{name}_base64"] = base64.b64encode(label_png(mask, schp.palette)).decode('utf-8')
+                result[f"label_ids_{name}"] = {label: i for i, label in mapping.items()}
+            elif output_format == "rle":
+                with stage("mask_encode"):
+                    result[f"rle_{name}"] = {mapping[i]: rle for i, rle in rle_encode(mask, present).items()}
+            elif output_format == "polygons":
+                with stage("mask_encode"):
+                    result[f"polygons_{name}"] = {mapping[i]: polys for i, polys in polygons(mask, present).items()}
+        return result
+
+    def segment_binary(self, image: Union[UploadFile, bytes, DecodedImage], parser: str, media_type: str,
+                       max_size: int = None):
+        """One parser's label map as raw bytes: a label-id PNG ("image/png") or H*W uint8 ("application/octet-stream").
+
+        Returns `(body, headers)`; headers carry the size and the ids of the labels present.
+        """
+        mask = self.parse_masks(image, [parser], max_size=max_size)[parser]
+        schp, mapping = self.parsers[parser]
+        present = [int(i) for i in np.flatnonzero(label_counts(mask)) if i in mapping]
+        headers = {
+            "X-Mask-Width": str(mask.shape[1]),
+            "X-Mask-Height": str(mask.shape[0]),
+            "X-Mask-Labels": ",".join(f"{i}={mapping[i]}" for i in present),
         }
+        with stage("mask_encode"):
+            body = label_png(mask, schp.palette) if media_type == "image/png" else np.ascontiguousarray(mask).tobytes()
+        return body, headers
+
+    def generate_color_mask_simple(self, mask, mapping, palette=False):
+        """Coloured mask and {label: hex colour} of the labels present.
 
-    def generate_color_mask_simple(self, mask, mapping):
-        h, w = mask.shape
-        color_mask = np.zeros((h, w, 3), dtype=np.uint8)
+        The RGB image comes from a single lookup-table gather. With
+        `palette=True` the label map itself becomes a "P" image carrying the
+        mapping's colour table: cheaper to build, but its PNG is larger on
+        fragmented masks (Pillow does not filter palette rows).
+        """
+        mask = np.asarray(mask, dtype=np.uint8)
+        lut = color_lut(mapping)
         color_map = {}
-        unique_indices = np.unique(mask)
-        for idx in unique_indices:
-            label = mapping.get(idx, None)
+        for idx in np.flatnonzero(label_counts(mask)):
+            label = mapping.get(int(idx), None)
             if label:
-                hex_color = LABEL_COLORS.get(label, "#CCCCCC")
-                color = tuple(int(hex_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
-                color_mask[mask == idx] = color
-                color_map[label] = hex_color
-        color_mask_img = Image.fromarray(color_mask).convert('RGB')
+                color_map[label] = LABEL_COLORS.get(label, "#CCCCCC")
+        if not palette:
+            return Image.fromarray(np.take(lut, mask, axis=0)), color_map
+        color_mask_img = Image.fromarray(mask)
+        color_mask_img.putpalette(lut.tobytes())
         return color_mask_img, color_map
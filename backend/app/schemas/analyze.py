@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+from typing import List, Dict, Optional
+from app.schemas.cross_modal import SearchResult
+from app.schemas.multi_label import MultiLabelResult
+from app.schemas.segmentation import SegmentationResponse
+from app.schemas.object_detection import DetectedObject
+
+class AnalyzeResponse(BaseModel):
+    search: Optional[List[SearchResult]] = None
+    classification: Optional[List[MultiLabelResult]] = None
+    segmentation: Optional[SegmentationResponse] = None
+    detected_objects: Optional[List[DetectedObject]] = None
+    timings_ms: Dict[str, float] = {}
+    cached: bool = False
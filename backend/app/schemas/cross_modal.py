@@ -6,5 +6,10 @@ class SearchResult(BaseModel):
     image_path: str
     score: float
 
+class AlphaSearchResults(BaseModel):
+    alpha: float
+    results: List[SearchResult]
+
 class SearchResponse(BaseModel):
     results: List[SearchResult]
+    results_by_alpha: Optional[List[AlphaSearchResults]] = None
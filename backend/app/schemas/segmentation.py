@@ -1,10 +1,24 @@
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 
+class RLEMask(BaseModel):
+    size: List[int]  # [height, width]
+    counts: str  # COCO compressed RLE
+
 class SegmentationResponse(BaseModel):
-    detected_labels_atr: List[str]
-    detected_labels_lip: List[str]
-    mask_color_atr_base64: Optional[str]
-    mask_color_lip_base64: Optional[str]
-    color_map_atr: Optional[Dict[str, str]]
-    color_map_lip: Optional[Dict[str, str]]
+    format: Optional[str] = None
+    mask_size: Optional[List[int]] = None  # [width, height]
+    detected_labels_atr: Optional[List[str]] = None
+    detected_labels_lip: Optional[List[str]] = None
+    mask_color_atr_base64: Optional[str] = None
+    mask_color_lip_base64: Optional[str] = None
+    color_map_atr: Optional[Dict[str, str]] = None
+    color_map_lip: Optional[Dict[str, str]] = None
+    mask_label_atr_base64: Optional[str] = None
+    mask_label_lip_base64: Optional[str] = None
+    label_ids_atr: Optional[Dict[str, int]] = None
+    label_ids_lip: Optional[Dict[str, int]] = None
+    rle_atr: Optional[Dict[str, RLEMask]] = None
+    rle_lip: Optional[Dict[str, RLEMask]] = None
+    polygons_atr: Optional[Dict[str, List[List[float]]]] = None
+    polygons_lip: Optional[Dict[str, List[List[float]]]] = None
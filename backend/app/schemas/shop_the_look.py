@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+from typing import List, Dict
+from app.schemas.cross_modal import SearchResult
+from app.schemas.object_detection import DetectedObject
+
+class LookItem(DetectedObject):
+    results: List[SearchResult]
+
+class ShopTheLookResponse(BaseModel):
+    items: List[LookItem]
+    timings_ms: Dict[str, float] = {}
+    cached: bool = False
@@ -0,0 +1,166 @@
+# Pre-fork serving: the models are loaded once in a master process, then N uvicorn workers are forked from it.
+# Workers share the model weights, embeddings and FAISS index pages copy-on-write, so adding a worker costs
+# its private memory (activations, caches) rather than a full copy of every model.
+#
+#   python -m app.serve --workers 4 --port 8000
+#   python -m app.serve --workers 4 --threads 2 --memory-report 60
+#
+# CPU only: a CUDA context does not survive fork (run one process per GPU instead).
+# Each worker has its own result cache, executors and /metrics (a scrape sees one worker).
+# The catalogue is read-only (a write would reach one worker only) and worker 0 alone saves the label cache.
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+
+
+def _bind(host, port, backlog):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(index, sock, args, warmup):
+    import torch
+    import faiss
+    import uvicorn
+    from app.main import app
+    from app.models.registry import model_registry
+    from app.utils.process import set_prefork_worker
+
+    set_prefork_worker(index)
+    # uvicorn installs its own handlers; the master's must not run in the worker
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    torch.set_num_threads(args.threads)
+    faiss.omp_set_num_threads(args.threads)
+    if warmup:
+        # Warm-up runs here, not in the master: it only allocates worker-private activations
+        model_registry.warm_up_loaded()
+    config = uvicorn.Config(app, log_level=args.log_level, lifespan="on", timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _spawn(index, sock, args, warmup):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(index, sock, args, warmup)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    print(f"[SERVE] worker {index} started (pid {pid})")
+    return pid
+
+
+def _memory_report(workers):
+    from app.utils.process import memory_info
+
+    rows = [("master", os.getpid())] + [(f"worker {index}", pid) for pid, index in sorted(workers.items(), key=lambda w: w[1])]
+    print(f"[SERVE] {'process':>10} {'pid':>8} {'rss MB':>9} {'pss MB':>9} {'private MB':>11}")
+    total_pss = 0.0
+    for name, pid in rows:
+        info = memory_info(pid)
+        total_pss += info["pss_mb"] or 0.0
+        print(f"[SERVE] {name:>10} {pid:>8} {info['rss_mb'] or 0:>9.0f} {info['pss_mb'] or 0:>9.0f} "
+              f"{info['private_mb'] or 0:>11.0f}")
+    print(f"[SERVE] total PSS {total_pss:.0f} MB for {len(workers)} workers")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork multi-worker server (models shared copy-on-write)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch / faiss threads per worker (default: CPU count / workers)")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--memory-report", type=float, default=0,
+                        help="print RSS / PSS per process every N seconds (0: once, after start-up)")
+    parser.add_argument("--no-respawn", action="store_true", help="do not restart workers that exit")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    args.threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    import torch
+    import faiss
+    from app.models.registry import MODEL_DEVICE, model_registry
+    from app.utils.process import rss_mb
+
+    if torch.device(MODEL_DEVICE).type != "cpu":
+        sys.exit(f"[SERVE] pre-fork mode is CPU only (MODEL_DEVICE={MODEL_DEVICE}): CUDA does not survive fork. "
+                 f"Use MODEL_DEVICE=cpu, or one uvicorn process per GPU.")
+
+    # The master stays single-threaded: an OpenMP pool started before fork() does not exist in the
+    # children, and a worker whose first parallel op waits on those threads hangs. Each worker raises
+    # its thread count after the fork (_run_worker)
+    torch.set_num_threads(1)
+    faiss.omp_set_num_threads(1)
+    # Everything shared is built before the fork; warm-up is deferred to the workers
+    warmup, model_registry.warmup = model_registry.warmup, False
+    from app.main import app  # noqa: F401  (routes, middlewares, catalogue imports)
+    start = time.perf_counter()
+    model_registry.load_all(wait=True)
+    print(f"[SERVE] models {', '.join(model_registry.enabled) or 'none'} loaded in "
+          f"{time.perf_counter() - start:.1f}s (master RSS {rss_mb():.0f} MB)")
+
+    sock = _bind(args.host, args.port, args.backlog)
+    # Objects that exist now are never scanned by the GC again, so collections in the workers
+    # do not write to (and un-share) the pages holding them
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+    workers = {}
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(args.workers):
+        workers[_spawn(index, sock, args, warmup)] = index
+    print(f"[SERVE] listening on {args.host}:{args.port} with {args.workers} workers, {args.threads} threads each")
+
+    next_report = time.monotonic() + 10
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            index = workers.pop(pid, None)
+            if index is not None and not stopping:
+                print(f"[SERVE] worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}")
+                if not args.no_respawn:
+                    workers[_spawn(index, sock, args, warmup)] = index
+            continue
+        if next_report is not None and time.monotonic() >= next_report and not stopping:
+            _memory_report(workers)
+            next_report = time.monotonic() + args.memory_report if args.memory_report > 0 else None
+        time.sleep(0.5)
+    sock.close()
+    print("[SERVE] all workers stopped")
+
+
+if __name__ == "__main__":
+    main()
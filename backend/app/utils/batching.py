@@ -0,0 +1,119 @@
+# Request-coalescing micro-batcher for model encoders
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+from app.utils.metrics import stage
+
+
+class MicroBatcher:
+    """Gathers single-item calls and runs them as one batched call.
+
+    Callers submit one item and block on (or await) a Future. A background
+    worker collects pending items until `max_batch_size` is reached or the
+    oldest item has waited `max_wait_ms`, then calls `batch_fn(items)` once
+    and fans the results back in order.
+
+    `active_callers`, if given, returns how many callers may submit at the
+    moment (e.g. the calls running in the model pool). Once they are all
+    queued the batch is sent without waiting: a lone request never pays
+    `max_wait_ms`, and a batch never grows past the pool's concurrency.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0, stats_window: int = 1024,
+                 active_callers: Optional[Callable[[], int]] = None):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.active_callers = active_callers
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        # --- Stats ---
+        self._batches = 0
+        self._items = 0
+        self._max_batch_seen = 0
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._wait_times = deque(maxlen=stats_window)
+
+    def submit(self, item) -> Future:
+        future = Future()
+        with self._cond:
+            # Worker is started lazily so that forked processes get their own thread
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+                self._worker.start()
+            self._queue.append((item, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def __call__(self, item):
+        # Wait in the queue plus the batched call, as seen by the caller
+        with stage(f"batch_{self.name}"):
+            return self.submit(item).result()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                if self.active_callers is not None and len(self._queue) >= self.active_callers():
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            size = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            items = [entry[0] for entry in batch]
+            futures = [entry[1] for entry in batch]
+            with self._cond:
+                self._batches += 1
+                self._items += len(batch)
+                self._max_batch_seen = max(self._max_batch_seen, len(batch))
+                self._batch_sizes.append(len(batch))
+                self._wait_times.extend(started - entry[2] for entry in batch)
+            try:
+                results = list(self.batch_fn(items))
+                if len(results) != len(futures):
+                    raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(futures)} items")
+            except BaseException as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self._wait_times)
+            sizes = list(self._batch_sizes)
+            queue_depth = len(self._queue)
+            batches, items, max_seen = self._batches, self._items, self._max_batch_seen
+
+        def percentile(values, q):
+            if not values:
+                return 0.0
+            return values[min(len(values) - 1, int(q * len(values)))]
+
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": queue_depth,
+            "batches": batches,
+            "items": items,
+            "mean_batch_size": (sum(sizes) / len(sizes)) if sizes else 0.0,
+            "max_batch_size_seen": max_seen,
+            "wait_ms_p50": percentile(waits, 0.50) * 1000.0,
+            "wait_ms_p99": percentile(waits, 0.99) * 1000.0,
+        }
@@ -0,0 +1,186 @@
+# Content-addressed result cache shared by the inference endpoints
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from app.utils import metrics
+
+RESULT_CACHE_MAX_MB = float(os.environ.get("RESULT_CACHE_MAX_MB", "256"))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR")  # optional on-disk tier
+# Size of the disk tier; over it the least recently used files are deleted down to 90% (0 = unbounded)
+RESULT_CACHE_DISK_MAX_MB = float(os.environ.get("RESULT_CACHE_DISK_MAX_MB", "1024"))
+
+
+class ResultCache:
+    """Two-tier cache of JSON-serializable endpoint results.
+
+    Keys are a hash of the uploaded image bytes plus the endpoint parameters.
+    The memory tier is an LRU bounded by the serialized size of its entries;
+    the optional disk tier stores one JSON file per key and survives restarts.
+    It is bounded by `disk_max_bytes`: files are ordered by mtime (refreshed
+    on every hit) and the oldest are deleted once the directory is over it.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str = None, disk_max_bytes: int = 0):
+        self.max_bytes = int(max_bytes)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_bytes)
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_size = 0  # bytes written since the last scan, on top of what the scan found
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_size = sum(size for _, _, size in self._scan_disk())
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 or bool(self.disk_dir)
+
+    @staticmethod
+    def make_key(endpoint: str, image_bytes: bytes = b"", **params) -> str:
+        h = hashlib.sha256()
+        h.update(endpoint.encode("utf-8"))
+        h.update(hashlib.sha256(image_bytes or b"").digest())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return h.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                try:
+                    # Recently used files are the last ones pruned
+                    os.utime(self._disk_path(key))
+                except OSError:
+                    pass
+                value = json.loads(data)
+                self._put_memory(key, value, len(data))
+                with self._lock:
+                    self.disk_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        data = json.dumps(value).encode("utf-8")
+        self._put_memory(key, value, len(data))
+        if self.disk_dir:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._disk_written(len(data))
+
+    def _scan_disk(self):
+        # (mtime, path, size) of the cached files; other processes may be writing or pruning the same directory
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, path, st.st_size))
+        return files
+
+    def _disk_written(self, size):
+        if self.disk_max_bytes <= 0:
+            return
+        with self._disk_lock:
+            self._disk_size += size
+            if self._disk_size <= self.disk_max_bytes:
+                return
+            # Rescanned rather than tracked: workers sharing the directory write to it too
+            files = sorted(self._scan_disk())
+            total = sum(size for _, _, size in files)
+            target = int(self.disk_max_bytes * 0.9)
+            for _, path, size in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.disk_evictions += 1
+            self._disk_size = total
+
+    def _put_memory(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir,
+                "disk_bytes": self._disk_size,
+                "disk_max_bytes": self.disk_max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+            }
+
+
+result_cache = ResultCache(int(RESULT_CACHE_MAX_MB * 1024 * 1024), RESULT_CACHE_DIR,
+                           int(RESULT_CACHE_DISK_MAX_MB * 1024 * 1024))
+
+
+def _cache_stat(key, **labels):
+    return lambda: [(labels, result_cache.stats()[key])]
+
+
+metrics.register_collector("fv_result_cache_hits_total", "Result cache hits by tier.", "counter",
+                           lambda: [({"tier": "memory"}, result_cache.hits), ({"tier": "disk"}, result_cache.disk_hits)])
+metrics.register_collector("fv_result_cache_misses_total", "Result cache misses.", "counter", _cache_stat("misses"))
+metrics.register_collector("fv_result_cache_evictions_total", "Result cache memory-tier evictions.", "counter",
+                           _cache_stat("evictions"))
+metrics.register_collector("fv_result_cache_disk_evictions_total", "Result cache files deleted by the disk-tier bound.",
+                           "counter", _cache_stat("disk_evictions"))
+metrics.register_collector("fv_result_cache_bytes", "Serialized size of the result cache memory tier.", "gauge",
+                           _cache_stat("bytes"))
@@ -1,8 +1,17 @@
 import os
-import requests
+import time
+import json
+import hmac
+import base64
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+import httpx
 from jose import jwt
 from fastapi import HTTPException, Header, Depends
 from dotenv import load_dotenv
+from app.utils.metrics import stage
 
 dotenv_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '.env'))
 load_dotenv(dotenv_path=dotenv_path)
@@ -11,39 +20,237 @@ SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
 SUPABASE_API_URL = os.environ.get("SUPABASE_API_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 
+# Credits taken from Supabase per round trip and kept locally (1 = no leasing)
+CREDIT_LEASE_SIZE = int(os.environ.get("CREDIT_LEASE_SIZE", "1"))
+# Unused leased credits are refunded after this many seconds
+CREDIT_LEASE_TTL = float(os.environ.get("CREDIT_LEASE_TTL", "60"))
+CREDIT_HTTP_MAX_CONNECTIONS = int(os.environ.get("CREDIT_HTTP_MAX_CONNECTIONS", "20"))
+CREDIT_HTTP_TIMEOUT = float(os.environ.get("CREDIT_HTTP_TIMEOUT", "5"))
+
+# Verified-token cache: repeat bearer tokens skip signature verification until they expire
+JWT_CACHE_SIZE = int(os.environ.get("JWT_CACHE_SIZE", "10000"))  # 0 disables the cache
+JWT_CACHE_TTL = float(os.environ.get("JWT_CACHE_TTL", "300"))
+# Verification backend: "jose" (python-jose), "hmac" (stdlib HS256) or "pyjwt" (needs PyJWT)
+JWT_BACKEND = os.environ.get("JWT_BACKEND", "jose")
+JWT_AUDIENCE = "authenticated"
+
+_token_cache = OrderedDict()  # sha256(token) -> (user_id, expires_at)
+_token_cache_lock = threading.Lock()
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+def _decode_jose(token: str) -> dict:
+    return jwt.decode(token, SUPABASE_JWT_SECRET, algorithms=["HS256"], audience=JWT_AUDIENCE)
+
+def _decode_hmac(token: str) -> dict:
+    # Minimal HS256 verification with the same checks python-jose applies for our tokens
+    header_b64, payload_b64, signature_b64 = token.split(".")
+    header = json.loads(_b64url_decode(header_b64))
+    if header.get("alg") != "HS256":
+        raise ValueError("unsupported alg")
+    expected = hmac.new(SUPABASE_JWT_SECRET.encode("utf-8"), f"{header_b64}.{payload_b64}".encode("ascii"),
+                        hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, _b64url_decode(signature_b64)):
+        raise ValueError("bad signature")
+    payload = json.loads(_b64url_decode(payload_b64))
+    now = time.time()
+    if "exp" in payload and now >= float(payload["exp"]):
+        raise ValueError("expired")
+    if "nbf" in payload and now < float(payload["nbf"]):
+        raise ValueError("not yet valid")
+    audience = payload.get("aud")
+    if JWT_AUDIENCE not in (audience if isinstance(audience, list) else [audience]):
+        raise ValueError("bad audience")
+    return payload
+
+def _decode_pyjwt(token: str) -> dict:
+    import jwt as pyjwt
+    return pyjwt.decode(token, SUPABASE_JWT_SECRET, algorithms=["HS256"], audience=JWT_AUDIENCE)
+
+_JWT_DECODERS = {
+    "jose": _decode_jose,
+    "hmac": _decode_hmac,
+    "pyjwt": _decode_pyjwt,
+}
+
+def verify_token(token: str) -> str:
+    """Returns the user id of a valid token, using the verified-token cache when enabled."""
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    now = time.time()
+    if JWT_CACHE_SIZE > 0:
+        with _token_cache_lock:
+            entry = _token_cache.get(digest)
+            if entry is not None:
+                if entry[1] > now:
+                    _token_cache.move_to_end(digest)
+                    return entry[0]
+                del _token_cache[digest]
+    payload = _JWT_DECODERS[JWT_BACKEND](token)
+    user_id = payload["sub"]
+    if JWT_CACHE_SIZE > 0:
+        expires_at = now + JWT_CACHE_TTL
+        if "exp" in payload:
+            expires_at = min(expires_at, float(payload["exp"]))
+        with _token_cache_lock:
+            _token_cache[digest] = (user_id, expires_at)
+            while len(_token_cache) > JWT_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return user_id
+
 def get_user_id_from_token(authorization: str = Header(...)):
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Token manquant")
     token = authorization.split(" ")[1]
     try:
-        payload = jwt.decode(token, SUPABASE_JWT_SECRET, algorithms=["HS256"], audience="authenticated")
-        return payload["sub"]  # user_id
+        with stage("auth"):
+            return verify_token(token)  # user_id
     except Exception as e:
         raise HTTPException(status_code=401, detail="Token invalide")
 
 
-def check_and_decrement_credit(user_id: str = Depends(get_user_id_from_token)):
-    headers = {
-        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-        "Content-Type": "application/json"
-    }
-    # 1. Récupérer le crédit
-    r = requests.get(
-        f"{SUPABASE_API_URL}/profiles?user_id=eq.{user_id}",
-        headers=headers
-    )
-    if not r.ok or not r.json():
-        raise HTTPException(status_code=403, detail="Utilisateur inconnu")
-    credits = r.json()[0]["credits"]
-    if credits <= 0:
-        raise HTTPException(status_code=402, detail="Plus de crédits")
-    # 2. Décrémenter le crédit
-    r2 = requests.patch(
-        f"{SUPABASE_API_URL}/profiles?user_id=eq.{user_id}",
-        headers=headers,
-        json={"credits": credits - 1}
-    )
-    if not r2.ok:
+_client = None
+_leases = {}  # user_id -> [remaining credits, expiry]
+_lease_locks = {}  # user_id -> [asyncio.Lock, coroutines using it], dropped when unused
+_settle_task = None
+
+def _get_client():
+    # One pooled keep-alive client per process, created lazily (fork-safe)
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=SUPABASE_API_URL,
+            headers={
+                "apikey": SUPABASE_SERVICE_ROLE_KEY,
+                "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+                "Content-Type": "application/json"
+            },
+            limits=httpx.Limits(max_connections=CREDIT_HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=CREDIT_HTTP_MAX_CONNECTIONS),
+            timeout=CREDIT_HTTP_TIMEOUT,
+        )
+    return _client
+
+async def _rpc(name: str, **params):
+    try:
+        with stage(f"credits_{name}"):
+            r = await _get_client().post(f"/rpc/{name}", json=params)
+    except httpx.HTTPError:
+        raise HTTPException(status_code=500, detail="Erreur crédit")
+    if not r.is_success:
         raise HTTPException(status_code=500, detail="Erreur crédit")
-    return user_id 
\ No newline at end of file
+    return r.json()
+
+async def _lease(user_id: str, amount: int) -> int:
+    # Atomic "take up to amount credits" in a single round trip (see lease_credits migration)
+    granted = await _rpc("lease_credits", p_user_id=user_id, p_amount=amount)
+    if granted is None:
+        raise HTTPException(status_code=403, detail="Utilisateur inconnu")
+    return int(granted)
+
+async def settle_leases(expired_only: bool = True):
+    """Refund unused leased credits, in one batch of RPCs."""
+    now = time.monotonic()
+    to_refund = []
+    for user_id, lease in list(_leases.items()):
+        if not expired_only or lease[1] <= now:
+            del _leases[user_id]
+            if lease[0] > 0:
+                to_refund.append((user_id, lease[0]))
+    if to_refund:
+        results = await asyncio.gather(
+            *(_rpc("refund_credits", p_user_id=user_id, p_amount=amount) for user_id, amount in to_refund),
+            return_exceptions=True,
+        )
+        for (user_id, amount), result in zip(to_refund, results):
+            if isinstance(result, Exception):
+                print(f"[WARN] Credit refund failed for {user_id} ({amount} credits)")
+
+async def _settle_loop():
+    while True:
+        await asyncio.sleep(CREDIT_LEASE_TTL / 2)
+        await settle_leases()
+
+async def close_credit_client():
+    global _client, _settle_task
+    if _settle_task is not None:
+        _settle_task.cancel()
+        _settle_task = None
+    await settle_leases(expired_only=False)
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _live_lease(user_id: str):
+    # An expired lease is never spent: when settle_leases has not run yet, it is refunded here
+    lease = _leases.get(user_id)
+    if lease is not None and lease[1] <= time.monotonic():
+        del _leases[user_id]
+        await refund_credit(user_id, lease[0])
+        return None
+    return lease
+
+async def charge_credits(user_id: str, amount: int = 1):
+    """Takes `amount` credits for one request, all or nothing (402 if the user has fewer)."""
+    if CREDIT_LEASE_SIZE <= 1:
+        granted = await _lease(user_id, amount)
+        if granted < amount:
+            if granted > 0:
+                await _rpc("refund_credits", p_user_id=user_id, p_amount=granted)
+            raise HTTPException(status_code=402, detail="Plus de crédits")
+        return
+
+    global _settle_task
+    if _settle_task is None:
+        _settle_task = asyncio.get_running_loop().create_task(_settle_loop())
+    entry = _lease_locks.get(user_id)
+    if entry is None:
+        entry = _lease_locks[user_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            lease = await _live_lease(user_id)
+            available = lease[0] if lease is not None else 0
+            if available < amount:
+                granted = await _lease(user_id, max(CREDIT_LEASE_SIZE, amount - available))
+                # settle_leases does not take the lock: the lease may have been refunded during the await,
+                # so the grant is added to what is there now, not to `available`
+                lease = await _live_lease(user_id)
+                if lease is not None:
+                    lease[0] += granted
+                    lease[1] = time.monotonic() + CREDIT_LEASE_TTL
+                elif granted > 0:
+                    lease = _leases[user_id] = [granted, time.monotonic() + CREDIT_LEASE_TTL]
+                # Credits granted short of `amount` stay in the lease (used or refunded later)
+                if lease is None or lease[0] < amount:
+                    raise HTTPException(status_code=402, detail="Plus de crédits")
+            lease[0] -= amount
+    finally:
+        # Only users with a charge in progress keep a lock
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _lease_locks[user_id]
+
+async def refund_credit(user_id: str, amount: int = 1):
+    """Gives back credits of work that was not served (back into the lease when there is one)."""
+    if amount <= 0:
+        return
+    lease = _leases.get(user_id)
+    if lease is not None:
+        lease[0] += amount
+        return
+    try:
+        await _rpc("refund_credits", p_user_id=user_id, p_amount=amount)
+    except HTTPException:
+        print(f"[WARN] Credit refund failed for {user_id} ({amount} credits)")
+
+async def check_and_decrement_credit(user_id: str = Depends(get_user_id_from_token)):
+    await charge_credits(user_id)
+    try:
+        yield user_id
+    except HTTPException as e:
+        # 503 = shed (model pool saturated) or model unavailable: the request was not served
+        if e.status_code == 503:
+            await refund_credit(user_id)
+        raise
@@ -0,0 +1,112 @@
+# Text-embedding cache for CLIP label vocabularies
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
+
+
+class TextEmbeddingCache:
+    """Bounded LRU of normalized text embeddings, keyed by label.
+
+    `encode_fn(labels)` must return a (len(labels), D) tensor. Besides the
+    per-label rows, the stacked matrix of recently used vocabularies is kept
+    so that a repeated label list costs a single lookup.
+    """
+
+    def __init__(self, encode_fn, max_entries: int = 50000, max_vocabularies: int = 256, device=None):
+        self.encode_fn = encode_fn
+        self.max_entries = max(1, int(max_entries))
+        self.max_vocabularies = max(0, int(max_vocabularies))
+        self.device = device
+        self._rows = OrderedDict()  # label -> (D,) tensor
+        self._matrices = OrderedDict()  # tuple(labels) -> (N, D) tensor
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _store(self, labels, features):
+        with self._lock:
+            for label, row in zip(labels, features):
+                self._rows[label] = row
+                self._rows.move_to_end(label)
+            while len(self._rows) > self.max_entries:
+                self._rows.popitem(last=False)
+
+    def encode(self, labels, chunk_size: int = 256):
+        """Encodes and caches labels that are not cached yet."""
+        with self._lock:
+            missing = [label for label in dict.fromkeys(labels) if label not in self._rows]
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            self._store(chunk, self.encode_fn(chunk))
+        return len(missing)
+
+    def matrix(self, labels):
+        """Returns the (len(labels), D) embedding matrix of `labels`, encoding only cache misses."""
+        key = tuple(labels)
+        with self._lock:
+            cached = self._matrices.get(key)
+            if cached is not None:
+                self._matrices.move_to_end(key)
+                self.hits += len(key)
+                return cached
+            rows = {label: self._rows.get(label) for label in key}
+        missing = [label for label, row in rows.items() if row is None]
+        if missing:
+            features = self.encode_fn(missing)
+            self._store(missing, features)
+            rows.update(zip(missing, features))
+        matrix = torch.stack([rows[label] for label in key])
+        with self._lock:
+            self.hits += len(key) - len(missing)
+            self.misses += len(missing)
+            if self.max_vocabularies:
+                self._matrices[key] = matrix
+                while len(self._matrices) > self.max_vocabularies:
+                    self._matrices.popitem(last=False)
+        return matrix
+
+    def preload_vocabulary(self, path: str):
+        """Encodes every non-empty line of a vocabulary file."""
+        with open(path, "r", encoding="utf-8") as f:
+            labels = [line.strip() for line in f if line.strip()]
+        return self.encode(labels)
+
+    def save(self, path: str):
+        with self._lock:
+            labels = list(self._rows.keys())
+            rows = [row.float().cpu().numpy() for row in self._rows.values()]
+        if not rows:
+            return
+        # Fixed-width unicode labels (no pickle); one temp file per writer, the last rename wins
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp_path, labels=np.array(labels, dtype=str), embeddings=np.stack(rows))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        if not os.path.exists(path):
+            return 0
+        data = np.load(path, allow_pickle=False)
+        try:
+            labels = [str(label) for label in data["labels"]]
+        except ValueError:
+            # Files written before labels were stored as unicode hold pickled objects: never unpickled
+            print(f"[WARN] Ignoring label cache {path} (pickled labels), it is rewritten on the next save")
+            return 0
+        features = torch.from_numpy(data["embeddings"]).to(self.device)
+        self._store(labels, features)
+        return len(labels)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "labels": len(self._rows),
+                "vocabularies": len(self._matrices),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
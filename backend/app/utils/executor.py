@@ -0,0 +1,124 @@
+# Bounded per-model execution pools so model calls never run on the event loop
+import os
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from app.utils import metrics
+
+# Default (concurrency, max queued calls) per model, overridable with <NAME>_CONCURRENCY / <NAME>_MAX_QUEUE
+DEFAULT_LIMITS = {
+    "clip": (4, 64),
+    "schp": (1, 8),
+    "detector": (2, 16),
+}
+
+
+class ModelExecutor:
+    """Thread pool with a hard cap on in-flight calls for one model.
+
+    At most `max_concurrency` calls run at once and at most `max_queue` wait
+    behind them; beyond that `run` fails fast with a 503 so a slow model sheds
+    load instead of piling up requests.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self._pool = None
+        self._pending = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        # Created on first use so that forked workers start their own threads
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=f"model-{self.name}")
+        return self._pool
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_concurrency + self.max_queue:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"Modèle {self.name} saturé, réessayez plus tard",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+            pool = self._get_pool()
+        try:
+            # Runs in the caller's context so the call's stages reach the request's Server-Timing
+            future = pool.submit(contextvars.copy_context().run, self._call, time.perf_counter(),
+                                 functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release(None)
+            raise
+        # The slot is freed when the call really finishes, even if the client went away
+        future.add_done_callback(self._release)
+        return future
+
+    def _call(self, submitted, fn):
+        metrics.record(f"queue_{self.name}", time.perf_counter() - submitted)
+        return fn()
+
+    def running(self) -> int:
+        """Calls currently executing in the pool (not the ones waiting for a slot)."""
+        return min(self._pending, self.max_concurrency)
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": min(self._pending, self.max_concurrency),
+                "queued": max(0, self._pending - self.max_concurrency),
+                "rejected": self._rejected,
+            }
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str) -> ModelExecutor:
+    with _executors_lock:
+        if name not in _executors:
+            concurrency, max_queue = DEFAULT_LIMITS.get(name, (1, 8))
+            env_name = name.upper()
+            _executors[name] = ModelExecutor(
+                name,
+                int(os.environ.get(f"{env_name}_CONCURRENCY", concurrency)),
+                int(os.environ.get(f"{env_name}_MAX_QUEUE", max_queue)),
+            )
+        return _executors[name]
+
+
+def executors_stats():
+    with _executors_lock:
+        executors = list(_executors.values())
+    return [e.stats() for e in executors]
+
+
+def _collect(key):
+    return lambda: (({"model": stats["name"]}, stats[key]) for stats in executors_stats())
+
+
+metrics.register_collector("fv_model_calls_in_flight", "Model calls running in each model pool.", "gauge",
+                           _collect("in_flight"))
+metrics.register_collector("fv_model_calls_queued", "Model calls waiting for a slot in each model pool.", "gauge",
+                           _collect("queued"))
+metrics.register_collector("fv_model_calls_rejected_total", "Model calls rejected with a 503 (pool saturated).",
+                           "counter", _collect("rejected"))
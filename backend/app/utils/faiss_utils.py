@@ -1,9 +1,190 @@
 # Utility functions for FAISS
+#
+# Build an index from the catalogue embeddings:
+#   python -m app.utils.faiss_utils build --type ivf_flat --nlist 1024
+#   python -m app.utils.faiss_utils build --type ivf_pq --nlist 4096 --pq-m 64
+#   python -m app.utils.faiss_utils build --type hnsw --hnsw-m 32 --ef-construction 200
+import os
+import json
+import math
+import time
+import argparse
+import numpy as np
+import faiss
 
-def load_faiss_index(path):
-    # TODO: Load and return a FAISS index from file
-    pass
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
 
-def search_faiss(index, vector, top_k):
-    # TODO: Search the FAISS index
-    pass
+
+def default_nlist(n: int) -> int:
+    # Usual rule of thumb: ~4 * sqrt(n) lists, at least 39 training points per list
+    return max(1, min(int(4 * math.sqrt(n)), n // 39 or 1))
+
+
+def build_index(embeddings, index_type="flat", nlist=None, pq_m=16, pq_nbits=8, hnsw_m=32,
+                ef_construction=200, train_size=100_000, nprobe=16, ef_search=64, seed=0):
+    """Builds an inner-product index over L2-normalized embeddings.
+
+    IVF indexes are trained on a random sample of at most `train_size` rows.
+    Returns `(index, params)`; `params` records the build parameters and the
+    default search knobs and is persisted next to the index.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    # Rows are converted chunk by chunk so a memory-mapped embeddings.npy is never fully loaded
+    n, d = embeddings.shape
+    params = {"type": index_type, "dim": d, "ntotal": n, "metric": "inner_product"}
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(d)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+        params.update({"hnsw_m": hnsw_m, "ef_construction": ef_construction, "ef_search": ef_search})
+    else:
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlatIP(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+            params.update({"pq_m": pq_m, "pq_nbits": pq_nbits})
+        index.nprobe = min(nprobe, nlist)
+        params.update({"nlist": nlist, "nprobe": index.nprobe})
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        rows = np.arange(n) if n <= train_size else np.sort(rng.choice(n, train_size, replace=False))
+        sample = np.ascontiguousarray(embeddings[rows], dtype="float32")
+        start = time.perf_counter()
+        index.train(sample)
+        params.update({"train_size": len(sample), "train_seconds": round(time.perf_counter() - start, 3)})
+
+    for start in range(0, n, 65536):
+        index.add(np.ascontiguousarray(embeddings[start:start + 65536], dtype="float32"))
+    return index, params
+
+
+def params_path(path):
+    return f"{path}.json"
+
+
+def save_faiss_index(index, path, params=None):
+    # Written to a temporary file first so readers never see a partial index
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+    if params is not None:
+        params = dict(params, ntotal=int(index.ntotal))
+        with open(params_path(path) + ".tmp", "w") as f:
+            json.dump(params, f, indent=2)
+        os.replace(params_path(path) + ".tmp", params_path(path))
+
+
+def load_index_params(path) -> dict:
+    if os.path.exists(params_path(path)):
+        with open(params_path(path)) as f:
+            return json.load(f)
+    return {}
+
+
+def load_faiss_index(path, io_flags=0):
+    index = faiss.read_index(path, io_flags)
+    # Apply the persisted default search knobs
+    params = load_index_params(path)
+    set_default_search_params(index, nprobe=params.get("nprobe"), ef_search=params.get("ef_search"))
+    return index
+
+
+def _ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _hnsw(index):
+    index = faiss.downcast_index(index)
+    while hasattr(index, "index") and not hasattr(index, "hnsw"):
+        index = faiss.downcast_index(index.index)
+    return index if hasattr(index, "hnsw") else None
+
+
+def set_default_search_params(index, nprobe=None, ef_search=None):
+    if nprobe is not None and _ivf(index) is not None:
+        _ivf(index).nprobe = int(nprobe)
+    if ef_search is not None and _hnsw(index) is not None:
+        _hnsw(index).hnsw.efSearch = int(ef_search)
+
+
+def make_search_params(index, nprobe=None, ef_search=None, sel=None):
+    """Per-request recall/latency knobs and id filter; None keeps the index defaults."""
+    ivf, hnsw = _ivf(index), _hnsw(index)
+    if nprobe is None and ef_search is None and sel is None:
+        return None
+    extra = {"sel": sel} if sel is not None else {}
+    # Parameter objects start from faiss defaults, so unset knobs are filled from the index
+    if ivf is not None:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe if nprobe is not None else ivf.nprobe), **extra)
+    if hnsw is not None:
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search if ef_search is not None else hnsw.hnsw.efSearch),
+                                          **extra)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+
+def search_faiss(index, vector, top_k, nprobe=None, ef_search=None, sel=None):
+    x = np.ascontiguousarray(vector, dtype="float32").reshape(-1, index.d)
+    params = make_search_params(index, nprobe=nprobe, ef_search=ef_search, sel=sel)
+    if params is None:
+        return index.search(x, top_k)
+    return index.search(x, top_k, params=params)
+
+
+def supports_add_with_ids(index) -> bool:
+    return _ivf(index) is not None or isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+
+def index_info(index) -> dict:
+    info = {"ntotal": int(index.ntotal), "dim": int(index.d), "class": type(faiss.downcast_index(index)).__name__}
+    if _ivf(index) is not None:
+        info.update({"nlist": int(_ivf(index).nlist), "nprobe": int(_ivf(index).nprobe)})
+    if _hnsw(index) is not None:
+        info["ef_search"] = int(_hnsw(index).hnsw.efSearch)
+    return info
+
+
+if __name__ == "__main__":
+    data_dir = os.path.join(os.path.dirname(__file__), "../data")
+    parser = argparse.ArgumentParser(description="FAISS index management")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build an index from embeddings.npy")
+    build.add_argument("--embeddings", default=os.path.join(data_dir, "embeddings.npy"))
+    build.add_argument("--output", default=os.path.join(data_dir, "faiss_index.index"))
+    build.add_argument("--type", choices=INDEX_TYPES, default="flat")
+    build.add_argument("--nlist", type=int, default=None)
+    build.add_argument("--nprobe", type=int, default=16)
+    build.add_argument("--pq-m", type=int, default=16)
+    build.add_argument("--pq-nbits", type=int, default=8)
+    build.add_argument("--hnsw-m", type=int, default=32)
+    build.add_argument("--ef-construction", type=int, default=200)
+    build.add_argument("--ef-search", type=int, default=64)
+    build.add_argument("--train-size", type=int, default=100_000)
+    info = sub.add_parser("info", help="print index parameters")
+    info.add_argument("--index", default=os.path.join(data_dir, "faiss_index.index"))
+    args = parser.parse_args()
+
+    if args.command == "build":
+        embeddings = np.load(args.embeddings, mmap_mode="r")
+        start = time.perf_counter()
+        index, params = build_index(
+            embeddings, args.type, nlist=args.nlist, pq_m=args.pq_m, pq_nbits=args.pq_nbits, hnsw_m=args.hnsw_m,
+            ef_construction=args.ef_construction, train_size=args.train_size, nprobe=args.nprobe,
+            ef_search=args.ef_search)
+        params["build_seconds"] = round(time.perf_counter() - start, 3)
+        save_faiss_index(index, args.output, params)
+        print(json.dumps(params, indent=2))
+    else:
+        index = load_faiss_index(args.index)
+        print(json.dumps({**load_index_params(args.index), **index_info(index)}, indent=2))
@@ -1,5 +1,160 @@
-# Utility functions for image processing
+# Shared image decode stage: one decode per upload, close to the resolution the models need
+import io
+import os
+import math
+import numpy as np
+from PIL import Image
+from app.utils.metrics import stage
+
+# Pixel budget of a decoded image (0 = unlimited); larger uploads are downscaled at decode time
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", "4000000"))
+# Decode JPEGs at a reduced DCT scale when the models only need a smaller image (PIL draft mode)
+IMAGE_DRAFT = os.environ.get("IMAGE_DRAFT", "1") == "1"
+# "pil" or "turbojpeg" (needs PyTurboJPEG and libjpeg-turbo, falls back to PIL when missing)
+IMAGE_DECODER = os.environ.get("IMAGE_DECODER", "pil")
+
+_turbojpeg = None
+if IMAGE_DECODER == "turbojpeg":
+    try:
+        from turbojpeg import TurboJPEG, TJPF_RGB
+        _turbojpeg = TurboJPEG()
+    except (ImportError, RuntimeError, OSError) as e:
+        print(f"[WARN] turbojpeg unavailable ({e}), decoding with PIL")
+
+
+class DecodedImage:
+    """An upload decoded once and shared by every model of a request.
+
+    `image` is the RGB PIL image (possibly smaller than the upload),
+    `original_size` the (width, height) of the upload, used to map outputs
+    such as boxes or masks back to the client's coordinates. `array` is a
+    read-only numpy view computed once and shared.
+    """
+
+    def __init__(self, image: Image.Image, original_size=None):
+        self.image = image
+        self.original_size = tuple(original_size or image.size)
+        self._array = None
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            array = np.asarray(self.image)
+            array.flags.writeable = False
+            self._array = array
+        return self._array
+
+    @property
+    def resized(self) -> bool:
+        return self.size != self.original_size
+
+
+def processor_min_side(image_processor, default=None):
+    """Shortest side a HF image processor resizes to, used as decode target."""
+    size = getattr(image_processor, "size", None) or {}
+    if isinstance(size, int):
+        return size
+    if "shortest_edge" in size:
+        return int(size["shortest_edge"])
+    if "height" in size and "width" in size:
+        return int(max(size["height"], size["width"]))
+    return default
+
+
+def _reduction(width, height, min_side=None, max_pixels=IMAGE_MAX_PIXELS):
+    """JPEG DCT reduction (1, 2, 4 or 8) for a decode that fits the budget and keeps `min_side`."""
+    reduction = 1
+    # Budget: smallest reduction whose output fits in max_pixels
+    while max_pixels and reduction < 8 and \
+            math.ceil(width / reduction) * math.ceil(height / reduction) > max_pixels:
+        reduction *= 2
+    # Model resolution: largest reduction that still leaves min_side pixels on the shortest side
+    if min_side and IMAGE_DRAFT:
+        while reduction < 8 and min(width, height) // (reduction * 2) >= min_side:
+            reduction *= 2
+    return reduction
+
+
+def _decode_turbojpeg(data: bytes, min_side=None, max_pixels=IMAGE_MAX_PIXELS):
+    width, height, _, _ = _turbojpeg.decode_header(data)
+    reduction = _reduction(width, height, min_side, max_pixels)
+    factor = (1, reduction) if (1, reduction) in _turbojpeg.scaling_factors else (1, 1)
+    array = _turbojpeg.decode(data, pixel_format=TJPF_RGB, scaling_factor=factor)
+    return Image.fromarray(array), (width, height)
+
+
+def load_image(source, min_side=None, max_pixels=IMAGE_MAX_PIXELS) -> DecodedImage:
+    """Decodes bytes, a path, a file object or an UploadFile into a DecodedImage.
+
+    JPEGs are decoded at a reduced DCT scale that fits `max_pixels` and, when
+    given, still leaves `min_side` pixels on the shortest side. Other formats
+    are downscaled after decoding when they exceed `max_pixels`.
+    DecodedImage and PIL images are passed through.
+    """
+    if isinstance(source, DecodedImage):
+        return source
+    with stage("decode"):
+        return _load_image(source, min_side, max_pixels)
+
+
+def _load_image(source, min_side, max_pixels) -> DecodedImage:
+    if isinstance(source, Image.Image):
+        return DecodedImage(source.convert("RGB"))
+    if hasattr(source, "file"):  # UploadFile
+        source = source.file
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+        if _turbojpeg is not None and data[:3] == b"\xff\xd8\xff":
+            try:
+                image, original_size = _decode_turbojpeg(data, min_side, max_pixels)
+                return DecodedImage(_fit(image, max_pixels), original_size)
+            except OSError:
+                pass  # not a baseline JPEG turbojpeg can read, PIL will report the error if any
+        source = io.BytesIO(data)
+
+    image = Image.open(source)
+    original_size = image.size
+    reduction = _reduction(*original_size, min_side=min_side, max_pixels=max_pixels)
+    if reduction > 1 and image.format == "JPEG":
+        # Decoded directly at 1/2, 1/4 or 1/8 scale by libjpeg
+        image.draft("RGB", (original_size[0] // reduction, original_size[1] // reduction))
+    return DecodedImage(_fit(image.convert("RGB"), max_pixels), original_size)
+
+
+def _fit(image: Image.Image, max_pixels):
+    width, height = image.size
+    if not max_pixels or width * height <= max_pixels:
+        return image
+    scale = math.sqrt(max_pixels / (width * height))
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+def crop_boxes(decoded: DecodedImage, boxes, padding: float = 0.0):
+    """PIL crops of `boxes` ([x1, y1, x2, y2] in upload coordinates) cut from the decoded image.
+
+    Boxes are grown by `padding` (a fraction of their width/height), mapped to
+    the decoded resolution and clamped to the image; each crop is at least 1px.
+    """
+    width, height = decoded.size
+    sx, sy = width / decoded.original_size[0], height / decoded.original_size[1]
+    crops = []
+    for x1, y1, x2, y2 in boxes:
+        pad_x, pad_y = (x2 - x1) * padding, (y2 - y1) * padding
+        left = min(max(0, int((x1 - pad_x) * sx)), width - 1)
+        top = min(max(0, int((y1 - pad_y) * sy)), height - 1)
+        right = max(left + 1, min(width, math.ceil((x2 + pad_x) * sx)))
+        bottom = max(top + 1, min(height, math.ceil((y2 + pad_y) * sy)))
+        crops.append(decoded.image.crop((left, top, right, bottom)))
+    return crops
+
 
 def read_imagefile(file) -> bytes:
-    # TODO: Read and return image bytes from UploadFile
-    pass
+    """Returns the bytes of an UploadFile (or file object) from the start."""
+    file = getattr(file, "file", file)
+    file.seek(0)
+    return file.read()
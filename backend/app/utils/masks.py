@@ -0,0 +1,99 @@
+# Compact encodings of segmentation label maps (uint8 H x W arrays of label ids)
+import io
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def label_counts(mask: np.ndarray) -> np.ndarray:
+    """Pixel count per label id, in one pass (cheaper than np.unique on large masks)."""
+    return np.bincount(mask.ravel(), minlength=256)
+
+
+def fit_size(size, max_size=None):
+    """(width, height) scaled down so that the longest side is at most `max_size`."""
+    width, height = size
+    if not max_size or max(width, height) <= max_size:
+        return width, height
+    scale = max_size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def label_png(mask: np.ndarray, palette) -> bytes:
+    """Single-channel palettized PNG: pixel values are label ids, the palette only drives display."""
+    img = Image.fromarray(mask)  # "L", turned into "P" by putpalette
+    img.putpalette(palette)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _rle_string(counts) -> str:
+    # COCO compressed RLE string (same encoding as pycocotools' rleToString)
+    chars = []
+    for i, x in enumerate(counts):
+        x = int(x)
+        if i > 2:
+            x -= int(counts[i - 2])
+        more = True
+        while more:
+            c = x & 0x1F
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return "".join(chars)
+
+
+def rle_encode(mask: np.ndarray, label_ids=None) -> dict:
+    """COCO RLE (column-major, compressed counts) of each label present in `mask`.
+
+    Runs are computed once for the whole label map; each label then only
+    picks its own runs. Returns {label_id: {"size": [h, w], "counts": str}}.
+    """
+    h, w = mask.shape
+    flat = mask.ravel(order="F")
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    starts = np.concatenate([[0], change])
+    ends = np.concatenate([change, [flat.size]])
+    values = flat[starts]
+    if label_ids is None:
+        label_ids = np.flatnonzero(label_counts(mask))
+    encoded = {}
+    for label_id in label_ids:
+        selected = values == label_id
+        s, e = starts[selected], ends[selected]
+        if not len(s):
+            continue
+        # Alternating background / foreground run lengths, starting with background
+        gaps = s - np.concatenate([[0], e[:-1]])
+        counts = np.empty(2 * len(s), dtype=np.int64)
+        counts[0::2], counts[1::2] = gaps, e - s
+        if e[-1] < flat.size:
+            counts = np.append(counts, flat.size - e[-1])
+        encoded[int(label_id)] = {"size": [h, w], "counts": _rle_string(counts)}
+    return encoded
+
+
+def polygons(mask: np.ndarray, label_ids=None, epsilon: float = 1.0, min_area: float = 4.0) -> dict:
+    """Outer contours of each label as COCO-style flat polygons [x1, y1, x2, y2, ...].
+
+    Contours are simplified with Douglas-Peucker (`epsilon` pixels) and
+    regions smaller than `min_area` pixels are dropped.
+    """
+    if label_ids is None:
+        label_ids = np.flatnonzero(label_counts(mask))
+    result = {}
+    for label_id in label_ids:
+        contours, _ = cv2.findContours((mask == label_id).astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        polys = []
+        for contour in contours:
+            if cv2.contourArea(contour) < min_area:
+                continue
+            contour = cv2.approxPolyDP(contour, epsilon, True) if epsilon else contour
+            if len(contour) >= 3:
+                polys.append(contour.reshape(-1).astype(float).tolist())
+        if polys:
+            result[int(label_id)] = polys
+    return result
@@ -0,0 +1,211 @@
+# Compact, memory-mapped catalogue metadata (replaces parsing metadonnees.json in every worker)
+#
+#   python -m app.utils.metadata_store convert   # metadonnees.json -> metadonnees.bin
+#
+# Layout (little-endian):
+#   header      b"FVMETA01", uint64 n_rows, uint64 n_labels
+#   label_offs  uint64[n_labels + 1]   offsets into the label blob
+#   label_blob  utf-8
+#   label_codes int32[n_rows]          index into the label table, -1 for a deleted row
+#   path_offs   uint64[n_rows + 1]     offsets into the path blob
+#   path_blob   utf-8
+# Rows are decoded lazily, one `idx` at a time; the OS page cache shares the file between workers.
+import os
+import mmap
+import hashlib
+import json
+import struct
+import threading
+import argparse
+import numpy as np
+
+MAGIC = b"FVMETA01"
+_HEADER = struct.Struct("<8sQQ")
+
+
+def _align8(offset):
+    return (offset + 7) & ~7
+
+
+class MetadataStore:
+    """Read-only view of metadonnees.bin, plus rows appended in memory since it was written.
+
+    Behaves like the list loaded from metadonnees.json: `store[idx]` returns
+    `{"label": ..., "path": ...}` or None for a deleted row, and `store + items`
+    returns a new store sharing the same mapped file.
+    """
+
+    def __init__(self, path=None, _base=None, _extra=()):
+        if _base is None:
+            _base = self._open(path)
+        self._base = _base
+        self._extra = tuple(_extra)
+        self._label_index = None
+
+    @staticmethod
+    def _open(path):
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_rows, n_labels = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a metadata store")
+        offset = _HEADER.size
+        label_offs = np.frombuffer(buf, dtype="<u8", count=n_labels + 1, offset=offset)
+        offset += label_offs.nbytes
+        labels = [bytes(buf[offset + int(a):offset + int(b)]).decode("utf-8")
+                  for a, b in zip(label_offs[:-1], label_offs[1:])]
+        offset = _align8(offset + int(label_offs[-1]))
+        codes = np.frombuffer(buf, dtype="<i4", count=n_rows, offset=offset)
+        offset = _align8(offset + codes.nbytes)
+        path_offs = np.frombuffer(buf, dtype="<u8", count=n_rows + 1, offset=offset)
+        offset += path_offs.nbytes
+        return {"buf": buf, "labels": labels, "codes": codes, "path_offs": path_offs, "path_blob": offset,
+                "n": int(n_rows)}
+
+    @property
+    def labels(self):
+        """Label table of the mapped file."""
+        return self._base["labels"]
+
+    @property
+    def label_codes(self):
+        """int32 label code per mapped row (-1 = deleted); appended rows are not included."""
+        return self._base["codes"]
+
+    def __len__(self):
+        return self._base["n"] + len(self._extra)
+
+    def __getitem__(self, idx):
+        idx = int(idx)
+        n = self._base["n"]
+        if idx < 0:
+            idx += len(self)
+        if idx >= n:
+            return self._extra[idx - n]
+        code = int(self._base["codes"][idx])
+        if code < 0:
+            return None
+        start, end = self._base["path_offs"][idx], self._base["path_offs"][idx + 1]
+        blob = self._base["path_blob"]
+        path = bytes(self._base["buf"][blob + int(start):blob + int(end)]).decode("utf-8")
+        return {"label": self._base["labels"][code], "path": path}
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __add__(self, items):
+        return MetadataStore(_base=self._base, _extra=self._extra + tuple(items))
+
+    def label_index(self):
+        """Inverted index label -> sorted int64 ids (deleted rows excluded).
+
+        The part covering the mapped file is built once and shared by every
+        store derived from it; appended rows are indexed per store.
+        """
+        if self._label_index is None:
+            base = self._base.get("label_index")
+            if base is None:
+                codes = self._base["codes"]
+                order = np.argsort(codes, kind="stable")
+                bounds = np.searchsorted(codes[order], np.arange(len(self.labels) + 1))
+                base = {label: order[bounds[c]:bounds[c + 1]].astype(np.int64)
+                        for c, label in enumerate(self.labels)}
+                self._base["label_index"] = base
+            extra = {}
+            for i, item in enumerate(self._extra):
+                if item is not None:
+                    extra.setdefault(item["label"], []).append(self._base["n"] + i)
+            index = dict(base)
+            for label, ids in extra.items():
+                index[label] = np.concatenate([index.get(label, np.zeros(0, dtype=np.int64)),
+                                               np.asarray(ids, dtype=np.int64)])
+            self._label_index = index
+        return self._label_index
+
+    def _path_hashes(self):
+        # Sorted 64-bit hashes of the mapped paths and their row ids, built once and shared
+        if "path_hashes" not in self._base:
+            buf, offs, blob = self._base["buf"], self._base["path_offs"], self._base["path_blob"]
+            hashes = np.fromiter(
+                (int.from_bytes(hashlib.blake2b(buf[blob + int(a):blob + int(b)], digest_size=8).digest(), "little")
+                 for a, b in zip(offs[:-1], offs[1:])), dtype=np.uint64, count=self._base["n"])
+            order = np.argsort(hashes, kind="stable")
+            self._base["path_hashes"] = (hashes[order], order)
+        return self._base["path_hashes"]
+
+    def find_path(self, path):
+        """Id of the live row whose path is `path`, or None."""
+        n = self._base["n"]
+        for i in range(len(self._extra) - 1, -1, -1):
+            if self._extra[i] is not None and self._extra[i]["path"] == path:
+                return n + i
+        hashes, order = self._path_hashes()
+        key = int.from_bytes(hashlib.blake2b(path.encode("utf-8"), digest_size=8).digest(), "little")
+        lo, hi = np.searchsorted(hashes, np.uint64(key), "left"), np.searchsorted(hashes, np.uint64(key), "right")
+        # Hash collisions are resolved by comparing the stored path
+        for idx in order[lo:hi]:
+            item = self[idx]
+            if item is not None and item["path"] == path:
+                return int(idx)
+        return None
+
+    def deleted_ids(self):
+        ids = np.flatnonzero(self._base["codes"] < 0).tolist()
+        ids.extend(self._base["n"] + i for i, item in enumerate(self._extra) if item is None)
+        return ids
+
+    @staticmethod
+    def write(path, records):
+        """Writes records (dicts with label/path, or None) atomically to `path`."""
+        label_ids = {}
+        codes, paths = [], []
+        for record in records:
+            if record is None:
+                codes.append(-1)
+                paths.append(b"")
+                continue
+            codes.append(label_ids.setdefault(record["label"], len(label_ids)))
+            paths.append(record["path"].encode("utf-8"))
+        labels = [label.encode("utf-8") for label in label_ids]
+        label_offs = np.concatenate([[0], np.cumsum([len(l) for l in labels], dtype=np.uint64)]).astype("<u8")
+        path_offs = np.concatenate([[0], np.cumsum([len(p) for p in paths], dtype=np.uint64)]).astype("<u8")
+
+        # One temp file per writer: workers converting metadonnees.json at the same startup each
+        # write their own file, and the renames replace one complete file with another
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, len(codes), len(labels)))
+            f.write(label_offs.tobytes())
+            f.write(b"".join(labels))
+            f.write(b"\0" * (_align8(f.tell()) - f.tell()))
+            f.write(np.asarray(codes, dtype="<i4").tobytes())
+            f.write(b"\0" * (_align8(f.tell()) - f.tell()))
+            f.write(path_offs.tobytes())
+            f.write(b"".join(paths))
+        os.replace(tmp_path, path)
+
+
+def open_metadata(data_dir):
+    """Opens metadonnees.bin, converting metadonnees.json on first use."""
+    bin_path = os.path.join(data_dir, "metadonnees.bin")
+    json_path = os.path.join(data_dir, "metadonnees.json")
+    if not os.path.exists(bin_path) or (
+            os.path.exists(json_path) and os.path.getmtime(json_path) > os.path.getmtime(bin_path)):
+        with open(json_path, "r") as f:
+            MetadataStore.write(bin_path, json.load(f))
+        print(f"[INFO] Converted {json_path} to {bin_path}")
+    return MetadataStore(bin_path)
+
+
+if __name__ == "__main__":
+    data_dir = os.path.join(os.path.dirname(__file__), "../data")
+    parser = argparse.ArgumentParser(description="Catalogue metadata store")
+    parser.add_argument("command", choices=["convert", "info"])
+    parser.add_argument("--data-dir", default=data_dir)
+    args = parser.parse_args()
+    if args.command == "convert":
+        with open(os.path.join(args.data_dir, "metadonnees.json"), "r") as f:
+            MetadataStore.write(os.path.join(args.data_dir, "metadonnees.bin"), json.load(f))
+    store = MetadataStore(os.path.join(args.data_dir, "metadonnees.bin"))
+    print(f"{len(store)} rows, {len(store.labels)} labels, {len(store.deleted_ids())} deleted")
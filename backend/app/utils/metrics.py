@@ -0,0 +1,296 @@
+# In-process metrics: stage timers, Prometheus text exposition on /metrics and a Server-Timing header
+#
+# Hot paths wrap their work in `with stage("name"):`. Each stage feeds the
+# fv_stage_duration_seconds histogram and, when it runs on behalf of an HTTP
+# request (event loop or model pool thread), that request's Server-Timing header.
+# With METRICS_ENABLED=0, `stage` returns a shared no-op context manager.
+#
+# Server-Timing is a response header: on StreamingResponse endpoints (/search/batch)
+# it only covers the stages that ran before the headers were sent. Later stages
+# still reach the histograms.
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import nullcontext
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# Attach a Server-Timing header (per-stage durations of the request) to every response
+METRICS_SERVER_TIMING = os.environ.get("METRICS_SERVER_TIMING", "1") == "1"
+# Histogram buckets in seconds
+METRICS_BUCKETS = tuple(float(b) for b in os.environ.get(
+    "METRICS_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30").split(","))
+
+# Stages of the current request: a list of (stage, seconds), None outside of a request
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra="") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                                for key, value in items]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram; per label set: [bucket counts..., sum, count]."""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=METRICS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = self.header()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Values read at scrape time from `collect()`, an iterable of (labels dict, value)."""
+
+    def __init__(self, name: str, documentation: str, metric_type: str, collect):
+        super().__init__(name, documentation)
+        self.type = metric_type
+        self.collect = collect
+
+    def render(self):
+        lines = self.header()
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.setdefault(metric.name, metric)
+            return self._metrics[metric.name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:  # a broken collector must not break the scrape
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+stage_seconds = REGISTRY.register(Histogram(
+    "fv_stage_duration_seconds", "Duration of instrumented processing stages.", ("stage",)))
+request_seconds = REGISTRY.register(Histogram(
+    "fv_http_request_duration_seconds", "HTTP request latency by route and status.", ("method", "route", "status")))
+requests_in_flight = REGISTRY.register(Gauge(
+    "fv_http_requests_in_flight", "HTTP requests being processed."))
+model_load_seconds = REGISTRY.register(Gauge(
+    "fv_model_load_seconds", "Time taken to load each model.", ("model",)))
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def record(name: str, seconds: float):
+    """Records an already-measured stage duration."""
+    if not METRICS_ENABLED:
+        return
+    stage_seconds.observe(seconds, stage=name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+_NOOP = nullcontext()
+
+
+def stage(name: str):
+    """Context manager timing one stage (histogram + Server-Timing of the current request)."""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Stage(name)
+
+
+def timed(fn, *args, **kwargs):
+    """Runs `fn` and returns `(result, milliseconds)`, for the timings_ms of a response.
+
+    Submitted to a model pool, it measures the call itself, excluding the wait for a free slot.
+    Unlike `stage`, it is measured even with METRICS_ENABLED=0.
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def observe_model_load(model: str, seconds: float):
+    if METRICS_ENABLED:
+        model_load_seconds.set(seconds, model=model)
+
+
+def _server_timing(stages, total) -> bytes:
+    # Repeated stages (batches, parallel parsers) are summed, first-seen order kept
+    durations = {}
+    for name, seconds in stages:
+        durations[name] = durations.get(name, 0.0) + seconds
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+def _route_label(scope) -> str:
+    # Route template (bounded cardinality), not the raw path
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        return "unmatched"
+    # Routes of included routers may hold a path relative to the router prefix
+    try:
+        rendered = route.path_format.format(**scope.get("path_params", {}))
+    except (AttributeError, KeyError, IndexError):
+        return template
+    path = scope["path"]
+    if rendered and path.endswith(rendered):
+        return path[:len(path) - len(rendered)] + template
+    return template
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency / in-flight metrics and the Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        stages = []
+        token = _request_stages.set(stages)
+        start = time.perf_counter()
+        status = "500"
+        requests_in_flight.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if METRICS_SERVER_TIMING:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", _server_timing(stages, time.perf_counter() - start)))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            requests_in_flight.dec()
+            request_seconds.observe(time.perf_counter() - start, method=scope["method"], route=_route_label(scope),
+                                    status=status)
+            _request_stages.reset(token)
+
+
+def register_collector(name: str, documentation: str, metric_type: str, collect):
+    """Adds a metric whose values are read at scrape time (cache sizes, executor queues...)."""
+    return REGISTRY.register(CallbackMetric(name, documentation, metric_type, collect))
+
+
+def render() -> str:
+    return REGISTRY.render()
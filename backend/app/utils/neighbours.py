@@ -0,0 +1,141 @@
+# Precomputed nearest neighbours of every catalogue item ("more like this" without running a model)
+#
+#   python -m app.utils.neighbours build --k 50 --threads 8
+#   python -m app.utils.neighbours build --k 50 --exact      # flat index instead of the catalogue index
+#   python -m app.utils.neighbours info
+#
+# neighbours.npy is a (n_items, k) structured array of (int32 id, float16 score), -1 padded,
+# memory-mapped at serving time; build parameters are stored next to it in neighbours.npy.json.
+# The sidecar also records the catalogue's cache_tag(): a table built from other catalogue files
+# (rebuild, saved adds or deletes) or served next to unsaved changes is not used.
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import faiss
+
+NEIGHBOURS_FILE = "neighbours.npy"
+NEIGHBOUR_DTYPE = np.dtype([("id", "<i4"), ("score", "<f2")])
+
+
+class NeighbourTable:
+    """Read-only, memory-mapped view of neighbours.npy."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.table = np.load(path, mmap_mode="r")
+        info_path = f"{path}.json"
+        self.info = {}
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                self.info = json.load(f)
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def k(self):
+        return self.table.shape[1]
+
+    def matches(self, catalogue_tag):
+        """True if the table was built from the catalogue identified by `catalogue_tag` (Catalogue.cache_tag())."""
+        return self.info.get("catalogue_tag") == catalogue_tag
+
+    def lookup(self, idx):
+        """Returns (ids, scores) of the precomputed neighbours of `idx`, or None if it was not in the build."""
+        if not 0 <= idx < len(self.table):
+            return None
+        row = self.table[idx]
+        valid = row["id"] >= 0
+        return row["id"][valid].astype(np.int64), row["score"][valid].astype(np.float32)
+
+
+def _neighbours_chunk(snapshot, start, end, k, deleted):
+    ids = np.arange(start, end, dtype=np.int64)
+    D, I = snapshot.search(snapshot.vectors(ids), k + 1)
+    # Drop the item itself (usually, but not always, the first hit) and keep k neighbours
+    own = I == ids[:, None]
+    order = np.argsort(own, axis=1, kind="stable")[:, :k]
+    I, D = np.take_along_axis(I, order, axis=1), np.take_along_axis(D, order, axis=1)
+    out = np.empty((end - start, k), dtype=NEIGHBOUR_DTYPE)
+    out["id"] = np.where(I >= 0, I, -1)
+    out["score"] = np.where(I >= 0, D, 0)
+    # Deleted items get no neighbours
+    if len(deleted):
+        out["id"][np.isin(ids, deleted)] = -1
+    return out
+
+
+def build_neighbours(snapshot, path, k=50, chunk_size=4096, threads=4, log_every=10, catalogue_tag=None):
+    """Computes the top-k neighbours of every id of `snapshot` and writes them to `path` atomically.
+
+    `catalogue_tag` (Catalogue.cache_tag() of the snapshot's catalogue) is stored in the sidecar;
+    the table is only served while the catalogue still has that tag.
+
+    Chunks of rows are searched concurrently (faiss releases the GIL) and
+    written straight into a memory-mapped output, so memory stays bounded.
+    """
+    n = snapshot.next_id
+    tmp_path = f"{path}.tmp.npy"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=NEIGHBOUR_DTYPE, shape=(n, k))
+    starts = list(range(0, n, chunk_size))
+    deleted = np.fromiter(snapshot.deleted, dtype=np.int64)
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        futures = [pool.submit(_neighbours_chunk, snapshot, s, min(s + chunk_size, n), k, deleted)
+                   for s in starts]
+        for done, (s, future) in enumerate(zip(starts, futures), 1):
+            out[s:s + chunk_size] = future.result()
+            if done % log_every == 0 or done == len(starts):
+                elapsed = time.perf_counter() - begin
+                print(f"[NEIGHBOURS] {min(s + chunk_size, n)}/{n} ({min(s + chunk_size, n) / elapsed:.0f} items/s)")
+    out.flush()
+    del out
+    os.replace(tmp_path, path)
+    info = {"k": k, "items": n, "catalogue_version": snapshot.version, "catalogue_tag": catalogue_tag,
+            "seconds": round(time.perf_counter() - begin, 3), "built_at": int(time.time())}
+    with open(f"{path}.json.tmp", "w") as f:
+        json.dump(info, f, indent=2)
+    os.replace(f"{path}.json.tmp", f"{path}.json")
+    return info
+
+
+if __name__ == "__main__":
+    data_dir = os.path.join(os.path.dirname(__file__), "../data")
+    parser = argparse.ArgumentParser(description="Precomputed catalogue neighbours")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="compute neighbours.npy from the catalogue")
+    build.add_argument("--data-dir", default=data_dir)
+    build.add_argument("--k", type=int, default=50)
+    build.add_argument("--chunk-size", type=int, default=4096)
+    build.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    build.add_argument("--exact", action="store_true", help="search a flat index (exact) instead of the catalogue index")
+    info = sub.add_parser("info", help="print the parameters of neighbours.npy")
+    info.add_argument("--data-dir", default=data_dir)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from app.models.catalogue import Catalogue, CatalogueSnapshot, _empty_delta
+        from app.utils.faiss_utils import build_index
+
+        catalogue = Catalogue(args.data_dir)
+        snapshot = catalogue.snapshot
+        if args.exact:
+            if len(snapshot.embeddings[0]) != snapshot.next_id:
+                parser.error("embeddings.npy and the catalogue metadata have different sizes")
+            flat, _ = build_index(snapshot.embeddings[0], "flat")
+            snapshot = CatalogueSnapshot(flat, _empty_delta(flat.d), snapshot.delta_vectors[:0], snapshot.metadonnees,
+                                         snapshot.deleted, snapshot.version, snapshot.embeddings)
+        # Parallelism comes from concurrent chunks, one OpenMP thread each
+        if args.threads > 1:
+            faiss.omp_set_num_threads(1)
+        result = build_neighbours(snapshot, os.path.join(args.data_dir, NEIGHBOURS_FILE), k=args.k,
+                                  chunk_size=args.chunk_size, threads=args.threads,
+                                  catalogue_tag=catalogue.cache_tag())
+        print(json.dumps(result, indent=2))
+    else:
+        table = NeighbourTable(os.path.join(args.data_dir, NEIGHBOURS_FILE))
+        print(json.dumps({**table.info, "rows": len(table), "k": table.k}, indent=2))
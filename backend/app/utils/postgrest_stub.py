@@ -0,0 +1,100 @@
+# Local stand-in for the Supabase PostgREST API used by app/utils/credits.py
+#
+#   python -m app.utils.postgrest_stub --port 54321 --default-credits 1000000
+#   SUPABASE_API_URL=http://127.0.0.1:54321 uvicorn app.main:app
+#
+# Implements the `profiles` table endpoints and the lease_credits / refund_credits
+# RPCs with the same semantics as the SQL functions, in memory.
+import argparse
+import threading
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import Response
+
+
+def create_app(default_credits: int = None) -> FastAPI:
+    """Build the stub app. With `default_credits`, unknown users are created on first use."""
+    app = FastAPI(title="PostgREST stub")
+    app.state.profiles = {}
+    app.state.calls = {}
+    lock = threading.Lock()
+
+    def count(name):
+        app.state.calls[name] = app.state.calls.get(name, 0) + 1
+
+    def get_profile(user_id, create=True):
+        profile = app.state.profiles.get(user_id)
+        if profile is None and create and default_credits is not None:
+            profile = app.state.profiles[user_id] = {"user_id": user_id, "credits": default_credits}
+        return profile
+
+    def user_filter(request: Request):
+        value = request.query_params.get("user_id", "")
+        if not value.startswith("eq."):
+            raise HTTPException(status_code=400, detail="only user_id=eq.<uuid> filters are supported")
+        return value[3:]
+
+    @app.get("/profiles")
+    async def select_profiles(request: Request):
+        count("select")
+        with lock:
+            profile = get_profile(user_filter(request))
+            return [dict(profile)] if profile else []
+
+    @app.patch("/profiles")
+    async def update_profiles(request: Request):
+        count("update")
+        body = await request.json()
+        with lock:
+            profile = get_profile(user_filter(request))
+            if profile:
+                profile.update({k: v for k, v in body.items() if k == "credits"})
+        return Response(status_code=204)
+
+    @app.post("/rpc/lease_credits")
+    async def lease_credits(request: Request):
+        count("lease_credits")
+        body = await request.json()
+        with lock:
+            profile = get_profile(body["p_user_id"])
+            if profile is None:
+                return None
+            granted = min(max(profile["credits"], 0), max(int(body.get("p_amount", 1)), 0))
+            profile["credits"] -= granted
+            return granted
+
+    @app.post("/rpc/refund_credits")
+    async def refund_credits(request: Request):
+        count("refund_credits")
+        body = await request.json()
+        with lock:
+            profile = get_profile(body["p_user_id"], create=False)
+            if profile is None:
+                return None
+            profile["credits"] += max(int(body["p_amount"]), 0)
+            return profile["credits"]
+
+    # --- Test helpers (not part of PostgREST) ---
+    @app.put("/_stub/profiles/{user_id}")
+    async def set_profile(user_id: str, request: Request):
+        body = await request.json()
+        with lock:
+            app.state.profiles[user_id] = {"user_id": user_id, "credits": int(body["credits"])}
+        return app.state.profiles[user_id]
+
+    @app.get("/_stub/stats")
+    async def stats():
+        return {"profiles": len(app.state.profiles), "calls": app.state.calls}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="In-memory PostgREST stand-in for the credit system")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--default-credits", type=int, default=None,
+                        help="credits given to unknown users on first use (default: unknown users are rejected)")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.default_credits), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,48 @@
+# Process-level resource helpers
+import os
+import resource
+
+# Index of this process among the app.serve workers, None outside pre-fork mode
+_prefork_worker = None
+
+
+def set_prefork_worker(index: int):
+    global _prefork_worker
+    _prefork_worker = index
+
+
+def prefork_worker():
+    """Index of this pre-fork worker (app/serve.py), or None when the app runs in a single process."""
+    return _prefork_worker
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        # Peak RSS fallback (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def memory_info(pid=None) -> dict:
+    """RSS, PSS (shared pages split between the processes mapping them) and private memory in MB (Linux)."""
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if rest.strip().endswith("kB"):
+                    values[key] = int(rest.split()[0]) / 1024
+    except (OSError, ValueError):
+        return {"rss_mb": rss_mb() if pid is None else None, "pss_mb": None, "private_mb": None, "shared_mb": None}
+    return {
+        "rss_mb": values.get("Rss"),
+        "pss_mb": values.get("Pss"),
+        "private_mb": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+        "shared_mb": values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0),
+    }
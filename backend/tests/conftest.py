@@ -0,0 +1,18 @@
+# Shared fixtures: credit calls go to the in-memory PostgREST stub (app/utils/postgrest_stub.py)
+import httpx
+import pytest
+from app.utils import credits
+from app.utils.postgrest_stub import create_app
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    app = create_app()
+    monkeypatch.setattr(credits, "_client", httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                                                base_url="http://stub"))
+    monkeypatch.setattr(credits, "_leases", {})
+    monkeypatch.setattr(credits, "_lease_locks", {})
+    monkeypatch.setattr(credits, "_settle_task", None)
+    yield app
+    # asyncio.run() cancelled the settle loop with its event loop
+    credits._settle_task = None
@@ -0,0 +1,82 @@
+# Billing of /search/batch: only answered queries are charged, whatever fails
+import json
+import asyncio
+import httpx
+import pytest
+from fastapi import FastAPI
+from PIL import UnidentifiedImageError
+from app.api import cross_modal
+from app.models.fashion_clip import FashionClipSingleton
+from app.models.registry import model_registry
+from app.utils.credits import get_user_id_from_token
+from tests.test_credits import remaining, set_credits
+
+
+class FakeClip:
+    """search_batch answers every query, except call number `fail_on` which raises `error`."""
+
+    def __init__(self, fail_on=None, error=None):
+        self.fail_on = fail_on
+        self.error = error
+        self.calls = 0
+
+    def decode_image(self, contents):
+        if contents == b"bad":
+            raise UnidentifiedImageError("bad")
+        return contents
+
+    def search_batch(self, texts, images, top_k, **kwargs):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise self.error
+        return [[{"label": "x", "image_path": "x.jpg", "score": 1.0}] for _ in list(texts) + list(images)]
+
+
+@pytest.fixture
+def search(stub, monkeypatch):
+    monkeypatch.setattr("app.utils.credits.CREDIT_LEASE_SIZE", 1)
+    monkeypatch.setattr(cross_modal, "SEARCH_BATCH_CHUNK", 2)
+    monkeypatch.setattr(model_registry._states["clip"], "instance", object())
+    app = FastAPI()
+    app.include_router(cross_modal.router, prefix="/search")
+    app.dependency_overrides[get_user_id_from_token] = lambda: "u1"
+    set_credits(stub, "u1", 100)
+
+    def run(clip, texts=(), images=(), per_credit=1):
+        monkeypatch.setattr(FashionClipSingleton, "_instance", clip)
+        monkeypatch.setattr(cross_modal, "SEARCH_BATCH_QUERIES_PER_CREDIT", per_credit)
+
+        async def post():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+                                         base_url="http://api") as client:
+                return await client.post("/search/batch", data={"texts": list(texts)},
+                                         files=[("images", (f"{i}.jpg", data)) for i, data in enumerate(images)])
+
+        response = asyncio.run(post())
+        lines = [json.loads(line) for line in response.text.splitlines()] if response.status_code == 200 else None
+        return response.status_code, lines, 100 - remaining(stub, "u1")
+    return run
+
+
+def test_invalid_images_are_not_charged(search):
+    status, lines, charged = search(FakeClip(), texts=["a", "b", "c"], images=[b"ok", b"bad"], per_credit=2)
+    assert status == 200
+    assert [("error" in line) for line in lines] == [False, False, False, False, True]
+    assert charged == 2  # 4 answered queries
+
+
+def test_first_chunk_failure_is_refunded(search):
+    status, _, charged = search(FakeClip(fail_on=1, error=RuntimeError("boom")), texts=["a", "b", "c"])
+    assert status == 500
+    assert charged == 0
+
+
+@pytest.mark.parametrize("error", [RuntimeError("boom"), cross_modal.HTTPException(status_code=503, detail="saturé")])
+def test_later_chunk_failure_charges_the_answered_queries(search, error):
+    before = cross_modal.batch_chunk_errors._values.copy()
+    status, lines, charged = search(FakeClip(fail_on=2, error=error), texts=list("abcdefg"), per_credit=3)
+    assert status == 200
+    assert len(lines) == 3 and lines[-1]["index"] == 2
+    assert lines[-1]["status"] == getattr(error, "status_code", 500)
+    assert charged == 1  # 2 answered queries, rounded up to one credit
+    assert cross_modal.batch_chunk_errors._values != before
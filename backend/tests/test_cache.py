@@ -0,0 +1,42 @@
+# Result cache disk tier: bounded, least recently used files pruned first
+import os
+from app.utils.cache import ResultCache
+
+
+def cached_files(cache):
+    return {name[:-5] for _, _, names in os.walk(cache.disk_dir) for name in names if name.endswith(".json")}
+
+
+def test_disk_tier_is_pruned_oldest_first(tmp_path):
+    value = {"results": "x" * 1000}  # ~1 KB per file
+    cache = ResultCache(0, str(tmp_path), disk_max_bytes=10 * 1024)
+    keys = [ResultCache.make_key("search", text=str(i)) for i in range(15)]
+    for i, key in enumerate(keys[:8]):
+        cache.put(key, value)
+        os.utime(cache._disk_path(key), (i, i))
+    # A hit makes the oldest file the most recently used one
+    assert cache.get(keys[0]) == value
+    for key in keys[8:]:
+        cache.put(key, value)
+
+    remaining = cached_files(cache)
+    assert sum(os.path.getsize(cache._disk_path(key)) for key in remaining) <= 10 * 1024
+    assert keys[0] in remaining and keys[-1] in remaining
+    assert keys[1] not in remaining
+    assert cache.stats()["disk_evictions"] == 15 - len(remaining)
+
+
+def test_existing_files_count_towards_the_bound(tmp_path):
+    value = {"results": "x" * 1000}
+    ResultCache(0, str(tmp_path)).put(ResultCache.make_key("search", text="old"), value)
+    cache = ResultCache(0, str(tmp_path), disk_max_bytes=1500)
+    assert cache.stats()["disk_bytes"] > 1000
+    cache.put(ResultCache.make_key("search", text="new"), value)
+    assert len(cached_files(cache)) == 1
+
+
+def test_unbounded_disk_tier(tmp_path):
+    cache = ResultCache(0, str(tmp_path))
+    for i in range(20):
+        cache.put(ResultCache.make_key("search", text=str(i)), {"i": i})
+    assert len(cached_files(cache)) == 20
@@ -0,0 +1,219 @@
+# Credit charging against the in-memory PostgREST stub (app/utils/postgrest_stub.py)
+#
+#   cd backend && python -m pytest -q tests
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app.utils import credits
+
+
+def set_credits(app, user_id, amount):
+    app.state.profiles[user_id] = {"user_id": user_id, "credits": amount}
+
+
+def remaining(app, user_id):
+    return app.state.profiles[user_id]["credits"]
+
+
+async def serve(user_id, error=None):
+    """Runs the dependency the way FastAPI does around a handler that succeeds or raises `error`."""
+    dependency = credits.check_and_decrement_credit(user_id)
+    assert await dependency.__anext__() == user_id
+    if error is None:
+        with pytest.raises(StopAsyncIteration):
+            await dependency.__anext__()
+    else:
+        with pytest.raises(HTTPException) as raised:
+            await dependency.athrow(error)
+        assert raised.value is error
+
+
+def test_each_request_takes_one_credit(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 1)
+    set_credits(stub, "u1", 2)
+
+    async def scenario():
+        await serve("u1")
+        await serve("u1")
+        with pytest.raises(HTTPException) as raised:
+            await serve("u1")
+        assert raised.value.status_code == 402
+
+    asyncio.run(scenario())
+    assert remaining(stub, "u1") == 0
+    assert stub.state.calls["lease_credits"] == 3
+
+
+def test_unknown_user_is_rejected(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 1)
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(serve("nobody"))
+    assert raised.value.status_code == 403
+
+
+def test_lease_takes_a_block_and_refunds_the_unused_part(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 10)
+    set_credits(stub, "u1", 25)
+
+    async def scenario():
+        for _ in range(3):
+            await serve("u1")
+        assert remaining(stub, "u1") == 15
+        assert credits._leases["u1"][0] == 7
+        await credits.settle_leases(expired_only=False)
+
+    asyncio.run(scenario())
+    assert remaining(stub, "u1") == 22
+    assert stub.state.calls == {"lease_credits": 1, "refund_credits": 1}
+    assert credits._leases == {}
+
+
+def test_lease_is_taken_once_by_concurrent_requests(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 10)
+    set_credits(stub, "u1", 100)
+
+    async def scenario():
+        await asyncio.gather(*(serve("u1") for _ in range(15)))
+
+    asyncio.run(scenario())
+    assert stub.state.calls["lease_credits"] == 2
+    assert remaining(stub, "u1") == 80
+    assert credits._leases["u1"][0] == 5
+
+
+def test_lease_is_refused_without_credits(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 10)
+    set_credits(stub, "u1", 0)
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(serve("u1"))
+    assert raised.value.status_code == 402
+    assert "u1" not in credits._leases
+
+
+def test_partial_lease_is_used_before_402(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 10)
+    set_credits(stub, "u1", 2)
+
+    async def scenario():
+        await serve("u1")
+        await serve("u1")
+        with pytest.raises(HTTPException) as raised:
+            await serve("u1")
+        assert raised.value.status_code == 402
+
+    asyncio.run(scenario())
+    assert remaining(stub, "u1") == 0
+
+
+@pytest.mark.parametrize("lease_size", [1, 10])
+def test_lease_locks_are_dropped(stub, monkeypatch, lease_size):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", lease_size)
+    for i in range(50):
+        set_credits(stub, f"u{i}", 1 if i % 2 else 0)
+
+    async def scenario():
+        results = await asyncio.gather(*(serve(f"u{i}") for i in range(50)), return_exceptions=True)
+        assert sum(isinstance(result, HTTPException) for result in results) == 25
+
+    asyncio.run(scenario())
+    assert credits._lease_locks == {}
+
+
+def test_shed_request_is_refunded_without_lease(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 1)
+    set_credits(stub, "u1", 5)
+
+    asyncio.run(serve("u1", HTTPException(status_code=503, detail="saturé")))
+    assert remaining(stub, "u1") == 5
+    assert stub.state.calls["refund_credits"] == 1
+
+
+def test_shed_request_is_refunded_into_the_lease(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 10)
+    set_credits(stub, "u1", 50)
+
+    async def scenario():
+        await serve("u1")
+        await serve("u1", HTTPException(status_code=503, detail="saturé"))
+        assert credits._leases["u1"][0] == 9
+
+    asyncio.run(scenario())
+    assert "refund_credits" not in stub.state.calls
+
+
+def test_client_errors_are_charged(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 1)
+    set_credits(stub, "u1", 5)
+
+    asyncio.run(serve("u1", HTTPException(status_code=400, detail="image invalide")))
+    assert remaining(stub, "u1") == 4
+
+
+@pytest.mark.parametrize("lease_size", [1, 10])
+def test_multi_credit_charge_is_all_or_nothing(stub, monkeypatch, lease_size):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", lease_size)
+    set_credits(stub, "u1", 30)
+
+    async def scenario():
+        await credits.charge_credits("u1", 25)
+        with pytest.raises(HTTPException) as raised:
+            await credits.charge_credits("u1", 25)
+        assert raised.value.status_code == 402
+        await credits.settle_leases(expired_only=False)
+
+    asyncio.run(scenario())
+    assert remaining(stub, "u1") == 5
+
+
+def test_multi_credit_refund(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 1)
+    set_credits(stub, "u1", 30)
+
+    async def scenario():
+        await credits.charge_credits("u1", 12)
+        await credits.refund_credit("u1", 5)
+
+    asyncio.run(scenario())
+    assert remaining(stub, "u1") == 23
+
+
+def test_lease_expiring_during_a_top_up_is_not_credited_twice(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 10)
+    set_credits(stub, "u1", 25)
+    lease = credits._lease
+
+    async def lease_while_expiring(user_id, amount):
+        # The settle loop runs while the top-up RPC is in flight and refunds the expired lease
+        credits._leases[user_id][1] = 0
+        await credits.settle_leases()
+        return await lease(user_id, amount)
+
+    async def scenario():
+        await serve("u1")
+        monkeypatch.setattr(credits, "_lease", lease_while_expiring)
+        with pytest.raises(HTTPException) as raised:
+            await credits.charge_credits("u1", 12)
+        assert raised.value.status_code == 402
+        assert credits._leases["u1"][0] == 10
+        await credits.settle_leases(expired_only=False)
+
+    asyncio.run(scenario())
+    assert remaining(stub, "u1") == 24
+
+
+def test_expired_lease_is_refunded_not_spent(stub, monkeypatch):
+    monkeypatch.setattr(credits, "CREDIT_LEASE_SIZE", 10)
+    set_credits(stub, "u1", 25)
+
+    async def scenario():
+        await serve("u1")
+        credits._leases["u1"][1] = 0
+        await serve("u1")
+        assert credits._leases["u1"][0] == 9
+        await credits.settle_leases(expired_only=False)
+
+    asyncio.run(scenario())
+    assert remaining(stub, "u1") == 23
+    assert stub.state.calls["lease_credits"] == 2
@@ -0,0 +1,63 @@
+# /search/similar: the neighbour table is only served while it matches the live catalogue
+import os
+import json
+import numpy as np
+import faiss
+import pytest
+from app.models.catalogue import Catalogue
+from app.models.fashion_clip import FashionClipSingleton
+from app.utils.neighbours import NEIGHBOURS_FILE, build_neighbours
+
+
+@pytest.fixture
+def clip(tmp_path):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((200, 16)).astype("float32")
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    np.save(tmp_path / "embeddings.npy", x)
+    index = faiss.IndexFlatIP(16)
+    index.add(x)
+    faiss.write_index(index, str(tmp_path / "faiss_index.index"))
+    with open(tmp_path / "metadonnees.json", "w") as f:
+        json.dump([{"label": "a", "path": f"p{i}.jpg"} for i in range(len(x))], f)
+    clip = FashionClipSingleton.__new__(FashionClipSingleton)
+    clip.catalogue = Catalogue(str(tmp_path))
+    return clip
+
+
+def build(clip, tmp_path):
+    catalogue = clip.catalogue
+    build_neighbours(catalogue.snapshot, os.path.join(tmp_path, NEIGHBOURS_FILE), k=5, threads=1,
+                     catalogue_tag=catalogue.cache_tag())
+    # Poisoned table: every row starts with the item itself, which a live search never returns
+    table = np.load(os.path.join(tmp_path, NEIGHBOURS_FILE), mmap_mode="r+")
+    table["id"][:, 0] = np.arange(len(table))
+    table.flush()
+
+
+def paths(results):
+    return [r["image_path"] for r in results]
+
+
+def test_current_table_is_served(clip, tmp_path):
+    build(clip, tmp_path)
+    assert clip.catalogue.current_neighbours() is not None
+    assert paths(clip.similar_items(item_id=3, top_k=3))[0] == "p3.jpg"
+
+
+def test_stale_table_falls_back_to_the_index(clip, tmp_path):
+    build(clip, tmp_path)
+    clip.catalogue.delete([199])
+    assert clip.catalogue.current_neighbours() is None
+    results = clip.similar_items(item_id=3, top_k=3)
+    assert len(results) == 3
+    assert "p3.jpg" not in paths(results) and "p199.jpg" not in paths(results)
+    # Saved changes change the files, and so the tag, as well
+    clip.catalogue.save()
+    assert clip.catalogue.current_neighbours() is None
+
+
+def test_without_table(clip):
+    assert len(clip.similar_items(item_id=3, top_k=4)) == 4
+    assert clip.similar_items(item_id=500) is None
+    assert clip.similar_items(image_path="p7.jpg", top_k=2)[0]["image_path"] != "p7.jpg"
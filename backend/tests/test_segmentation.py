@@ -0,0 +1,59 @@
+# /segment JSON responses only carry the fields of the requested format
+import asyncio
+import httpx
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from app.api import segmentation
+from app.models.registry import model_registry
+from app.models.schp import ATR_MAPPING, LIP_MAPPING, SCHPSingleton
+from app.utils.cache import result_cache
+from app.utils.credits import check_and_decrement_credit, get_user_id_from_token
+
+
+class FakeParser:
+    palette = [0, 0, 0] * 256
+
+
+@pytest.fixture
+def segment(monkeypatch):
+    schp = SCHPSingleton.__new__(SCHPSingleton)
+    schp.parsers = {"atr": (FakeParser(), ATR_MAPPING), "lip": (FakeParser(), LIP_MAPPING)}
+    mask = np.zeros((8, 6), dtype=np.uint8)
+    mask[2:6, 1:4] = 4
+    # No model: the label maps stand in for the parsers' output
+    monkeypatch.setattr(schp, "parse_masks", lambda image, parsers, max_size=None: {p: mask for p in parsers})
+    monkeypatch.setattr(SCHPSingleton, "_instance", schp)
+    monkeypatch.setattr(model_registry._states["schp"], "instance", schp)
+    monkeypatch.setattr(result_cache, "get", lambda key: None)
+    app = FastAPI()
+    app.include_router(segmentation.router, prefix="/segment")
+    app.dependency_overrides[check_and_decrement_credit] = lambda: "u1"
+    app.dependency_overrides[get_user_id_from_token] = lambda: "u1"
+
+    def run(**form):
+        async def post():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as client:
+                return await client.post("/segment/", data=form, files={"image": ("a.jpg", b"jpeg")})
+        response = asyncio.run(post())
+        assert response.status_code == 200, response.text
+        return response.json()
+    return run
+
+
+@pytest.mark.parametrize("output_format, fields", [
+    ("rle", {"rle_atr"}),
+    ("polygons", {"polygons_atr"}),
+    ("label_png", {"mask_label_atr_base64", "label_ids_atr"}),
+    ("labels", set()),
+])
+def test_compact_formats_have_no_null_keys(segment, output_format, fields):
+    body = segment(format=output_format, parsers="atr")
+    assert set(body) == {"format", "mask_size", "detected_labels_atr"} | fields
+    assert None not in body.values()
+
+
+def test_default_format_keeps_both_parsers(segment):
+    body = segment()
+    assert set(body) == {"format", "mask_size", "detected_labels_atr", "detected_labels_lip", "mask_color_atr_base64",
+                         "mask_color_lip_base64", "color_map_atr", "color_map_lip"}
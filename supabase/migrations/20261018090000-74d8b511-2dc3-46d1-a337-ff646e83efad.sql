@@ -0,0 +1,42 @@
+-- Atomic credit operations for the backend API (one round trip, no lost decrements)
+
+-- Take up to p_amount credits from a user; returns the number granted (0 when empty), NULL for an unknown user
+CREATE OR REPLACE FUNCTION public.lease_credits(p_user_id UUID, p_amount INTEGER DEFAULT 1)
+RETURNS INTEGER AS $$
+DECLARE
+  current_credits INTEGER;
+  granted INTEGER;
+BEGIN
+  SELECT credits INTO current_credits
+  FROM public.profiles
+  WHERE user_id = p_user_id
+  FOR UPDATE;
+  IF NOT FOUND THEN
+    RETURN NULL;
+  END IF;
+  granted := LEAST(GREATEST(current_credits, 0), GREATEST(p_amount, 0));
+  IF granted > 0 THEN
+    UPDATE public.profiles SET credits = credits - granted WHERE user_id = p_user_id;
+  END IF;
+  RETURN granted;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = '';
+
+-- Give back credits that were leased but not consumed
+CREATE OR REPLACE FUNCTION public.refund_credits(p_user_id UUID, p_amount INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+  remaining INTEGER;
+BEGIN
+  UPDATE public.profiles SET credits = credits + GREATEST(p_amount, 0)
+  WHERE user_id = p_user_id
+  RETURNING credits INTO remaining;
+  RETURN remaining;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = '';
+
+-- Only the backend (service role) may move credits
+REVOKE EXECUTE ON FUNCTION public.lease_credits(UUID, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.refund_credits(UUID, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.lease_credits(UUID, INTEGER) TO service_role;
+GRANT EXECUTE ON FUNCTION public.refund_credits(UUID, INTEGER) TO service_role;